@@ -0,0 +1,49 @@
+from functools import lru_cache
+
+from fasttea import FastTEA, Model, Msg, Cmd, Element, CSSFramework
+from fasttea.html import div, h1, input_, p, tr, th, td, virtual_table
+
+
+PEOPLE = [(i, f"Person {i}", f"person{i}@example.com") for i in range(100_000)]
+
+
+@lru_cache(maxsize=64)
+def search(query: str) -> list[tuple[int, str, str]]:
+    return [person for person in PEOPLE if query in person[1]] if query else PEOPLE
+
+
+class AppModel(Model):
+    query: str = ""
+
+
+app = FastTEA(AppModel(), css_framework=CSSFramework.PICO)
+
+
+def view_row(person: tuple[int, str, str]) -> Element:
+    number, name, email = person
+    return tr({"style": "height: 40px"}, [td({}, str(number)), td({}, name), td({}, email)])
+
+
+people = app.virtual_rows("people", lambda model: search(model.query), view_row, row_height=40, height=600)
+
+
+@app.update
+def update(msg: Msg, model: AppModel) -> tuple[AppModel, Cmd | None]:
+    if msg.action == "search":
+        model.query = msg.value or ""
+    return model, None
+
+
+@app.view
+def view(model: AppModel) -> Element:
+    return div({}, [
+        h1({}, "100k Rows"),
+        input_({"id": "query", "type": "search", "value": model.query, "placeholder": "Search",
+                "onChanging": "search"}, ""),
+        p({}, f"{len(search(model.query))} people"),
+        virtual_table(people, model, header=tr({}, [th({}, "#"), th({}, "Name"), th({}, "Email")])),
+    ])
+
+
+if __name__ == "__main__":
+    app.run()
@@ -1,5 +1,5 @@
 from fasttea import FastTEA, Model, Msg, CSSFramework, Element
-from fasttea.html import h1, h3, p, div, img, button
+from fasttea.html import h1, h3, p, div, img, button, lazy, template
 from fasttea.picocss import container, grid, group
 import random
 
@@ -159,6 +159,7 @@ def update(msg: Msg, model: BlackjackModel) -> tuple[BlackjackModel, None]:
 
 
 @app.view
+@template
 def view(model: BlackjackModel) -> Element:
     return container({"style":"transform: scale(0.8); transform-origin: 0 0;"}, [
 
@@ -172,6 +173,7 @@ def view(model: BlackjackModel) -> Element:
     ])
 
 
+@template
 def view_hands(model: BlackjackModel) -> Element:
     return div({},
         [
@@ -186,8 +188,8 @@ def view_hands(model: BlackjackModel) -> Element:
 
 
 def view_hand(hand: list[Card]) -> Element:
-    return div({"style": "display: flex; flex-wrap: wrap; gap: 10px;"}, [view_card(card) for card in hand])
-    #return grid({}, [view_card(card) for card in hand])
+    return div({"style": "display: flex; flex-wrap: wrap; gap: 10px;"}, [lazy(view_card, card) for card in hand])
+    #return grid({}, [lazy(view_card, card) for card in hand])
 
 def get_card_image_name(card:Card)->str:
     return f'card_{card.suit.value}_{card.rank.value}.png'
@@ -207,6 +209,7 @@ def view_card(card: Card) -> Element:
                 "alt": f"{card.rank.value} of {card.suit.value}"})
 
 
+@template
 def view_controls(model: BlackjackModel) -> Element:
     return group({},
         [
@@ -218,6 +221,7 @@ def view_controls(model: BlackjackModel) -> Element:
     )
 
 
+@template
 def view_bet_and_balance(model: BlackjackModel) -> Element:
     return div({},
         [
@@ -238,4 +242,5 @@ def view_bet_and_balance(model: BlackjackModel) -> Element:
         ]
     )
 
-app.run()
\ No newline at end of file
+if __name__ == "__main__":
+    app.run()
\ No newline at end of file
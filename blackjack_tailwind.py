@@ -235,4 +235,5 @@ def view_bet_and_balance(model: BlackjackModel) -> Element:
         ]
     )
 
-app.run()
\ No newline at end of file
+if __name__ == "__main__":
+    app.run()
\ No newline at end of file
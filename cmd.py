@@ -1,10 +1,9 @@
 from fastapi import FastAPI
-from pydantic import BaseModel
-from fasttea import FastTEA, CSSFramework, Element, Msg, Cmd
+from fasttea import FastTEA, CSSFramework, Element, Msg, Cmd, ImmutableModel
 from fasttea.html import div, input_, button, p
 
 # Model definition
-class AppModel(BaseModel):
+class AppModel(ImmutableModel):
     name: str = ""
     time: str = ""
 
@@ -20,7 +19,7 @@ app = FastTEA(
 def update(msg: Msg, model: AppModel) -> tuple[AppModel, Cmd | None]:
     match msg.action:
         case "change_name":
-            new_model = AppModel(name=msg.value, time=model.time)
+            new_model = model.evolve(name=msg.value)
             if new_model.name and new_model.time:
                 return new_model, Cmd(action="show_message", payload={
                     "message": f"Name: {new_model.name}, Time: {new_model.time}"
@@ -29,7 +28,7 @@ def update(msg: Msg, model: AppModel) -> tuple[AppModel, Cmd | None]:
         case "new_time":
             return model, Cmd(action="get_time")
         case "set_time":
-            return AppModel(name=model.name, time=msg.value), None
+            return model.evolve(time=msg.value), None
     return model, None
 
 # View function
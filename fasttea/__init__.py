@@ -1,11 +1,34 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
-from pydantic import BaseModel
-from typing import Callable, Dict, Any, List, Union
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+from typing import Callable, Dict, Any, Iterator, List, Mapping, Sequence, Union
 from enum import Enum
+from html import escape
+from sys import intern
+from types import MappingProxyType
+from collections import OrderedDict
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import contextvars
+import copy
+import inspect
+import itertools
+import json
 import os
+import re
+import threading
+import time
 import toml
 from rich import print
+from .http_cache import strong_etag, etag_matches, content_hash, IMMUTABLE_CACHE_CONTROL
+from .staticfiles import StaticFiles
+from .compression import CompressionMiddleware
+from .history import MessageLog, replay
+from .metrics import Instrument, Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .subscriptions import Sub, Every, FromQueue, FromIterator, Topic, SubscriptionRunner
+from .session import (Session, SessionBackend, MemorySessionBackend, SessionConflictError, SESSION_COOKIE,
+                      new_session_id, copy_model)
 
 
 class CSSFramework(Enum):
@@ -15,12 +38,63 @@ class CSSFramework(Enum):
     TAILWIND = '<script src="https://cdn.tailwindcss.com"></script>'  #Tailwind CSS as an option
 
 
+class Transport(Enum):
+    HTTP = 'http'
+    WEBSOCKET = 'websocket'  # messages and view patches over one WebSocket per client
+
+
 # region TEA
 class Model(BaseModel):
     """Base class for the application state"""
     pass
 
 
+class ImmutableModel(Model):
+    """Frozen application state, changed with evolve instead of in place
+
+    Unchanged field values are shared between a model and its evolved copies, so views can compare
+    them with `is`. Field values are never changed in place, lists are replaced by new lists.
+    """
+    model_config = ConfigDict(frozen=True)
+    _changed: frozenset = PrivateAttr(default=frozenset())
+
+    def evolve(self, **changes: Any) -> 'ImmutableModel':
+        """Copy with the given fields replaced, the model itself if no value changes
+
+        Like model_copy(update=...) the new values are not validated.
+        """
+        fields = type(self).model_fields
+        unknown = changes.keys() - fields.keys()
+        if unknown:
+            raise ValueError(f"{type(self).__name__} has no fields {', '.join(sorted(unknown))}")
+        changed = frozenset(name for name, value in changes.items() if not _same_value(getattr(self, name), value))
+        if not changed:
+            return self
+        model = self.model_copy(update={name: changes[name] for name in changed})
+        model._changed = changed
+        return model
+
+    @property
+    def changed_fields(self) -> frozenset:
+        """Fields replaced by the evolve call which created this model"""
+        return self._changed
+
+    def __eq__(self, other: Any) -> bool:
+        # the changed fields are bookkeeping, equal values make equal models
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(_same_value(getattr(self, name), getattr(other, name)) for name in type(self).model_fields)
+
+    def __hash__(self) -> int:
+        return hash(tuple(getattr(self, name) for name in type(self).model_fields))
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    return a is b or a == b
+
+
 class Msg(BaseModel):
     """Base class for messages"""
     action: str
@@ -33,80 +107,636 @@ class Cmd(BaseModel):
     payload: Dict[str, Any] = {}
     # New field for automatic message sending
     return_msg: Union[Msg, None] = None
+    # commands of a batch, see Cmd.batch
+    cmds: List['Cmd'] = []
+
+    @classmethod
+    def batch(cls, cmds: List['Cmd']) -> 'Cmd':
+        """Several commands as one, like Cmd.batch in Elm"""
+        return cls(action=BATCH_ACTION, cmds=cmds)
+
+    def flat(self) -> List['Cmd']:
+        """The commands of a (nested) batch"""
+        if self.action != BATCH_ACTION:
+            return [self]
+        return [cmd for batched in self.cmds for cmd in batched.flat()]
+
+
+BATCH_ACTION = 'batch'
+Cmd.model_rebuild()
 
 
 # endregion
 
 # region html
+class Markup(str):
+    """Trusted HTML, written to the output without escaping"""
+    pass
+
+
+class StaticMarkup(Markup):
+    """Trusted HTML serialized ahead of time, the minifying mode writes its minified variant"""
+
+    def __new__(cls, html: str, minified: str):
+        markup = super().__new__(cls, html)
+        markup.minified = minified
+        return markup
+
+    def __reduce__(self):
+        return StaticMarkup, (str(self), self.minified)
+
+
+VOID_ELEMENTS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+                           'track', 'wbr'})
+RAW_TEXT_ELEMENTS = frozenset({'script', 'style'})
+# whitespace is significant in these elements and kept by the minifying mode
+PREFORMATTED_ELEMENTS = frozenset({'pre', 'textarea'})
+
+
+# shared by all elements without attributes or children, read only so no element can change them
+EMPTY_ATTRIBUTES: Mapping[str, Any] = MappingProxyType({})
+EMPTY_CHILDREN: tuple = ()
+
+
 class Element:
-    _id: int = 0
+    """Node of a view, attributes and children are replaced instead of changed in place
+
+    attributes is always a read only copy of the given dict and children always a tuple.
+    """
+    __slots__ = ('tag', 'attributes', 'children')
 
     def __init__(self, tag: str,
                  attributes: Dict[str, Any],
                  children: Union[List['Element'], 'Element', str]):
-        self.tag = tag
-        self.attributes = attributes
-        self.children = children if isinstance(children, list) else [children]
+        _set_tag(self, intern(tag))
+        _set_attributes(self, MappingProxyType(dict(attributes)) if attributes else EMPTY_ATTRIBUTES)
+        if isinstance(children, tuple):
+            _set_children(self, children or EMPTY_CHILDREN)
+        elif isinstance(children, list):
+            _set_children(self, tuple(children) if children else EMPTY_CHILDREN)
+        else:
+            _set_children(self, (children,))
+
+    def __setattr__(self, name: str, value: Any):
+        if name == 'attributes':
+            value = MappingProxyType(dict(value)) if value else EMPTY_ATTRIBUTES
+        elif name == 'children':
+            value = (tuple(value) or EMPTY_CHILDREN) if isinstance(value, (list, tuple)) else (value,)
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # the read only attributes can't be pickled or deep copied themselves
+        return Element, (self.tag, dict(self.attributes), self.children)
 
-    def to_htmx(self) -> str:
-        self.add_htmx_attributes()
-        attrs = ' '.join(f"{k}='{v}'" for k, v in self.attributes.items() if v is not None)
-        children_html = ''.join(
-            child.to_htmx() if isinstance(child, Element) else str(child) for child in self.children)
-        return f"<{self.tag} {attrs}>{children_html}</{self.tag}>"
+    def to_htmx(self, minify: bool = False) -> str:
+        return render_htmx(self, minify)
+
+    def iter_htmx(self, chunk_size: int = 16384, minify: bool = False) -> Iterator[str]:
+        return iter_htmx(self, chunk_size, minify)
 
     def test_add_htmx_attribute(self, attribut: str, value: str):
         if attribut not in self.attributes:
-            self.attributes[attribut] = value
-
-    def add_htmx_attributes(self):
-        """Add HTMX attributes to elements with onClick, onChanging or onChange handlers"""
-        if 'onClick' in self.attributes:
-            action = self.attributes['onClick']
-            self.attributes.pop('onClick')
-
-            if 'getValue' in self.attributes:
-                id = self.attributes['getValue']
-                self.attributes.pop('getValue')
-                self.attributes[
+            self.attributes = {**self.attributes, attribut: value}
+
+    def add_htmx_attributes(self, ids: Union['IdAllocator', None] = None):
+        """Add HTMX attributes to elements with onClick, onChanging or onChange handlers
+
+        Pass the same ids to all elements of one view, their generated ids are then distinct.
+        """
+        self.attributes = self.htmx_attributes(ids)
+
+    def htmx_attributes(self, ids: Union['IdAllocator', None] = None) -> Dict[str, Any]:
+        """Attributes with onClick, onChanging or onChange replaced by HTMX attributes, the element is not changed
+
+        An element with onChanging or onChange but without id gets one from ids, see IdAllocator.
+        """
+        attributes = self.attributes
+        if 'onClick' in attributes:
+            attributes = dict(attributes)
+            action = attributes.pop('onClick')
+
+            if 'getValue' in attributes:
+                id = attributes.pop('getValue')
+                attributes[
                     "hx-vals"] = f'js:{{"action": "{action}","value": document.getElementById("{id}").value}}'
             else:
-                self.attributes["hx-vals"] = f'{{"action": "{action}"}}'
+                attributes["hx-vals"] = f'{{"action": "{action}"}}'
 
-            self.attributes.update({
+            attributes.update({
                 "hx-post": "/update",
                 "hx-trigger": "click",
                 "hx-swap": "innerHTML"
             })
-            self.test_add_htmx_attribute("hx-target", "#app")
+            attributes.setdefault("hx-target", "#app")
 
-        elif 'onChange' in self.attributes or 'onChanging' in self.attributes:
-            if 'onChange' in self.attributes:
-                action = self.attributes['onChange']
-                self.attributes.pop('onChange')
+        elif 'onChange' in attributes or 'onChanging' in attributes:
+            attributes = dict(attributes)
+            if 'onChange' in attributes:
+                action = attributes.pop('onChange')
                 trigger = "change"
             else:
-                action = self.attributes['onChanging']
-                self.attributes.pop('onChanging')
+                action = attributes.pop('onChanging')
                 trigger = "keyup changed delay:500ms"
 
-            if 'id' not in self.attributes:
-                self.attributes['id'] = self.create_id()
+            if 'id' not in attributes:
+                attributes['id'] = (ids if ids is not None else IdAllocator()).next(action)
 
-            id = self.attributes['id']
+            id = attributes['id']
 
-            self.attributes.update({
+            attributes.update({
                 "hx-post": "/update",
                 "hx-trigger": trigger,
                 "hx-vals": f'js:{{"action": "{action}","value": document.getElementById("{id}").value}}',
                 "hx-swap": "innerHTML"
             })
-            self.test_add_htmx_attribute("hx-target", "#app")
+            attributes.setdefault("hx-target", "#app")
+        return attributes
 
-    def create_id(self) -> str:
-        value = f'id{Element._id}'
-        Element._id += 1
-        return value
+
+# the constructor writes the slots directly, the conversions of __setattr__ are done there already
+_set_tag = Element.tag.__set__
+_set_attributes = Element.attributes.__set__
+_set_children = Element.children.__set__
+
+
+_UNSAFE_ID = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def _safe_id(value: Any) -> str:
+    # ids are written into JavaScript strings and CSS selectors
+    return _UNSAFE_ID.sub('_', str(value))
+
+
+def _function_scope(fn: Callable) -> str:
+    # lambdas of one function share their qualified name, the line tells them apart
+    scope = f'{getattr(fn, "__module__", None)}.{getattr(fn, "__qualname__", fn)}'
+    code = getattr(fn, '__code__', None)
+    if getattr(fn, '__name__', None) == '<lambda>' and code is not None:
+        scope = f'{scope}-{code.co_firstlineno}'
+    return _safe_id(scope)
+
+
+class IdAllocator:
+    """Ids of the elements of one render which have onChange or onChanging but no id
+
+    The id is made of the id of the closest enclosing element with an id (the scope), the action and
+    the count of earlier elements with the same action in that scope. The same view gets the same ids
+    on every render and an out of band patch, whose root always has an id, gets the ids of the full
+    render, so ids never come from global state.
+    """
+    __slots__ = ('_scopes',)
+
+    def __init__(self, scope: str = 'app'):
+        self._scopes: List[tuple[str, Dict[str, int]]] = [(_safe_id(scope), {})]
+
+    def enter(self, scope: Any):
+        self._scopes.append((_safe_id(scope), {}))
+
+    def leave(self):
+        self._scopes.pop()
+
+    def next(self, action: Any) -> str:
+        scope, counts = self._scopes[-1]
+        action = _safe_id(action)
+        count = counts.get(action, 0)
+        counts[action] = count + 1
+        return f'ft-{scope}-{action}-{count}'
+
+
+_closing_tags: Dict[str, Markup] = {}
+_attribute_cache: Dict[tuple, str] = {}
+_ATTRIBUTE_CACHE_SIZE = 4096
+
+
+def _closing_tag(tag: str) -> Markup:
+    closing = _closing_tags.get(tag)
+    if closing is None:
+        closing = _closing_tags[tag] = Markup(f'</{tag}>')
+    return closing
+
+
+def _attribute(key: str, value: Any) -> str:
+    """Serialized attribute, the same pairs show up on every render so they are cached"""
+    # True, 1 and 1.0 are equal keys but are written differently, so the type is part of the key
+    cache_key = (key, type(value), value)
+    try:
+        return _attribute_cache[cache_key]
+    except KeyError:
+        pass
+    except TypeError:
+        return f' {key}="{escape(str(value))}"'
+    if len(_attribute_cache) >= _ATTRIBUTE_CACHE_SIZE:
+        _attribute_cache.clear()
+    serialized = _attribute_cache[cache_key] = f' {key}="{escape(str(value))}"'
+    return serialized
+
+
+def _start_tag(element: Element, ids: IdAllocator) -> str:
+    attributes = element.attributes
+    if 'onClick' in attributes or 'onChange' in attributes or 'onChanging' in attributes:
+        attributes = element.htmx_attributes(ids)
+    if attributes:
+        return '<' + element.tag + ''.join([_attribute(key, value) for key, value in attributes.items()
+                                            if value is not None]) + '>'
+    return '<' + element.tag + '>'
+
+
+def write_htmx(element: Element, write: Callable[[str], Any], minify: bool = False,
+               ids: Union[IdAllocator, None] = None):
+    """Serialize a tree without recursion, every piece of HTML is passed to write
+
+    With minify runs of whitespace in text are collapsed to one space, except in pre and textarea.
+    """
+    if ids is None:
+        ids = IdAllocator()
+    stack: List[Any] = [element]
+    pop = stack.pop
+    push = stack.append
+    extend = stack.extend
+    # open pre and textarea elements of the minifying mode
+    preformatted = 0
+    while stack:
+        node = pop()
+        if isinstance(node, Element):
+            tag = node.tag
+            start = _start_tag(node, ids)
+            if tag in VOID_ELEMENTS:
+                write(start)
+                continue
+            children = node.children
+            if len(children) == 1 and not isinstance(children[0], (Element, Lazy)):
+                # leaf elements are written in one piece
+                child = children[0]
+                if isinstance(child, Markup) or tag in RAW_TEXT_ELEMENTS:
+                    if minify and not preformatted and tag not in PREFORMATTED_ELEMENTS \
+                            and isinstance(child, StaticMarkup):
+                        child = child.minified
+                    write(start + str(child) + _closing_tag(tag))
+                elif minify and not preformatted and tag not in PREFORMATTED_ELEMENTS:
+                    write(start + _collapse_whitespace(escape(str(child), quote=False)) + _closing_tag(tag))
+                else:
+                    write(start + escape(str(child), quote=False) + _closing_tag(tag))
+                continue
+            write(start)
+            push(_closing_tag(tag))
+            scope = node.attributes.get('id')
+            if scope is not None:
+                ids.enter(scope)
+                push(_END_SCOPE)
+            if minify and tag in PREFORMATTED_ELEMENTS:
+                preformatted += 1
+                push(_END_PREFORMATTED)
+            if tag in RAW_TEXT_ELEMENTS:
+                extend(child if isinstance(child, Element) else Markup(child) for child in reversed(children))
+            else:
+                extend(reversed(children))
+        elif isinstance(node, Markup):
+            write(node.minified if minify and not preformatted and isinstance(node, StaticMarkup) else node)
+        elif isinstance(node, Lazy):
+            write(node.html())
+        elif node is _END_PREFORMATTED:
+            preformatted -= 1
+        elif node is _END_SCOPE:
+            ids.leave()
+        elif minify and not preformatted:
+            write(_collapse_whitespace(escape(str(node), quote=False)))
+        else:
+            write(escape(str(node), quote=False))
+
+
+_END_PREFORMATTED = object()
+_END_SCOPE = object()
+_WHITESPACE = re.compile(r'[ \t\n\r\f]+')
+
+
+def _collapse_whitespace(text: str) -> str:
+    return _WHITESPACE.sub(' ', text)
+
+
+def render_htmx(element: Element, minify: bool = False, ids: Union[IdAllocator, None] = None) -> str:
+    """HTML of a tree, built in one buffer"""
+    buffer: List[str] = []
+    write_htmx(element, buffer.append, minify, ids)
+    return ''.join(buffer)
+
+
+def iter_htmx(element: Element, chunk_size: int = 16384, minify: bool = False) -> Iterator[str]:
+    """HTML of a tree in chunks of at least chunk_size characters (except the last one)
+
+    Container elements are opened here and their children serialized one by one while the chunks
+    are consumed, so a long table is never held as one string.
+    """
+    stack: List[Any] = [element]
+    buffer: List[str] = []
+    pending: List[str] = []
+    pending_size = 0
+    ids = IdAllocator()
+    while stack:
+        node = stack.pop()
+        if (isinstance(node, Element) and node.tag not in VOID_ELEMENTS and node.tag not in RAW_TEXT_ELEMENTS
+                and node.tag not in PREFORMATTED_ELEMENTS
+                and any(isinstance(child, (Element, Lazy)) for child in node.children)):
+            pending.append(_start_tag(node, ids))
+            stack.append(_closing_tag(node.tag))
+            scope = node.attributes.get('id')
+            if scope is not None:
+                ids.enter(scope)
+                stack.append(_END_SCOPE)
+            stack.extend(reversed(node.children))
+            continue
+        if node is _END_SCOPE:
+            ids.leave()
+            continue
+        if isinstance(node, Element):
+            write_htmx(node, buffer.append, minify, ids)
+            piece = ''.join(buffer)
+            buffer.clear()
+        elif isinstance(node, Markup):
+            piece = node.minified if minify and isinstance(node, StaticMarkup) else node
+        elif isinstance(node, Lazy):
+            piece = node.html()
+        elif minify:
+            piece = _collapse_whitespace(escape(str(node), quote=False))
+        else:
+            piece = escape(str(node), quote=False)
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= chunk_size:
+            yield ''.join(pending)
+            pending.clear()
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+# endregion
+
+# region lazy
+class LazyCache:
+    """Bounded per session cache of lazy subtrees, keyed by function and call position in the view"""
+
+    def __init__(self, maxsize: int = 256, minify: bool = False):
+        self.maxsize = maxsize
+        # the cached HTML is written in the serializer mode of the app
+        self.minify = minify
+        self._entries: OrderedDict[tuple, tuple[tuple, Markup]] = OrderedDict()
+        self._positions: Dict[Callable, int] = {}
+
+    def begin_view(self):
+        self._positions.clear()
+
+    def next_key(self, fn: Callable) -> tuple:
+        position = self._positions.get(fn, 0)
+        self._positions[fn] = position + 1
+        return fn, position
+
+    def get(self, key: tuple, args: tuple) -> Union[Markup, None]:
+        entry = self._entries.get(key)
+        if entry is None or not _same_args(entry[0], args):
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, args: tuple, html: Markup):
+        # mutable arguments are copied, a model changed in place must not look like the cached one
+        if not all(_is_immutable(arg) for arg in args):
+            args = copy.deepcopy(args)
+        self._entries[key] = (args, html)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+def _same_args(cached: tuple, args: tuple) -> bool:
+    return len(cached) == len(args) and all(_same_value(a, b) for a, b in zip(cached, args))
+
+
+_IMMUTABLE_TYPES = (ImmutableModel, str, int, float, bool, bytes, type(None), Enum, frozenset)
+
+
+def _is_immutable(value: Any) -> bool:
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+_lazy_cache: ContextVar[Union[LazyCache, None]] = ContextVar('fasttea_lazy_cache', default=None)
+
+
+class Lazy:
+    """Subtree built by fn(*args), its HTML is reused while the arguments compare equal to the last render"""
+
+    def __init__(self, fn: Callable[..., Element], args: tuple):
+        self.fn = fn
+        self.args = args
+        self._cache = _lazy_cache.get()
+        self._key = self._cache.next_key(fn) if self._cache is not None else None
+        self._html: Union[Markup, None] = None
+
+    def html(self) -> Markup:
+        if self._html is None:
+            if self._cache is not None:
+                self._html = self._cache.get(self._key, self.args)
+            if self._html is None:
+                minify = self._cache is not None and self._cache.minify
+                # generated ids are scoped by the call position, the cached HTML stays valid there
+                scope = _function_scope(self.fn)
+                if self._key is not None:
+                    scope = f'{scope}-{self._key[1]}'
+                self._html = Markup(render_htmx(self.fn(*self.args), minify, IdAllocator(scope)))
+                if self._cache is not None:
+                    self._cache.put(self._key, self.args, self._html)
+        return self._html
+
+
+def _resolve_lazy(element: Element):
+    """Render the lazy subtrees of a tree, they use the cache and model of the session"""
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        for child in node.children:
+            if isinstance(child, Element):
+                stack.append(child)
+            elif isinstance(child, Lazy):
+                child.html()
+
+
+# endregion
+
+# region diff
+def _same_node(old: Element, new: Element) -> bool:
+    return old.tag == new.tag and old.attributes == new.attributes and len(old.children) == len(new.children)
+
+
+def _has_stable_id(old: Element, new: Element) -> bool:
+    return new.attributes.get('id') is not None and old.attributes.get('id') == new.attributes.get('id')
+
+
+def _collect_patches(old: Element, new: Element, patches: List[Element]) -> bool:
+    """Collect the changed subtrees of new, returns False if a change can't be anchored below this node"""
+    if not _same_node(old, new):
+        return False
+    start = len(patches)
+    for old_child, new_child in zip(old.children, new.children):
+        if isinstance(old_child, Element) and isinstance(new_child, Element):
+            if not _collect_patches(old_child, new_child, patches):
+                if not _has_stable_id(old_child, new_child):
+                    del patches[start:]
+                    return False
+                patches.append(new_child)
+        elif isinstance(old_child, Lazy) and isinstance(new_child, Lazy):
+            if old_child.html() != new_child.html():
+                del patches[start:]
+                return False
+        elif isinstance(old_child, (Element, Lazy)) or isinstance(new_child, (Element, Lazy)) \
+                or str(old_child) != str(new_child):
+            del patches[start:]
+            return False
+    return True
+
+
+def diff_elements(old: Element, new: Element) -> Union[List[Element], None]:
+    """Changed subtrees of new (anchored by their id), None if the whole tree has to be replaced"""
+    patches: List[Element] = []
+    if _collect_patches(old, new, patches):
+        return patches
+    if _has_stable_id(old, new):
+        return [new]
+    return None
+
+
+def oob_htmx(patches: List[Element], minify: bool = False) -> str:
+    """HTMX out of band swaps, every patch replaces the element with the same id"""
+    return ''.join(Element(patch.tag, {**patch.attributes, 'hx-swap-oob': 'true'}, patch.children).to_htmx(minify)
+                   for patch in patches)
+
+
+# endregion
+
+# region virtual
+class RowSource:
+    """Items of the model shown by virtual_table or virtual_list, see FastTEA.virtual_rows
+
+    Only the rows of the visible window plus overscan are rendered, further windows are fetched
+    from /_fasttea/rows/{name} while the client scrolls. Every row must be row_height pixels high.
+    The HTML of rows is cached by key_fn(item) (the item itself by default, unhashable items are
+    rendered every time), the cache is shared by all sessions.
+    """
+
+    def __init__(self, name: str, items_fn: Callable[[Any], Sequence[Any]], row_fn: Callable[[Any], Element],
+                 row_height: int = 32, height: int = 480, overscan: int = 10,
+                 key_fn: Union[Callable[[Any], Any], None] = None, cache_size: int = 10000, minify: bool = False):
+        self.name = name
+        self.items_fn = items_fn
+        self.row_fn = row_fn
+        self.row_height = row_height
+        self.height = height
+        self.overscan = overscan
+        self.key_fn = key_fn
+        self.cache_size = cache_size
+        self.minify = minify
+        self.element_id = f'fasttea-rows-{name}'
+        self._cache: OrderedDict[Any, Markup] = OrderedDict()
+        # blocking views render rows in the thread pool
+        self._lock = threading.Lock()
+        # scopes of the generated ids of rows, a row keeps its ids while its HTML is cached
+        self._scopes = itertools.count()
+
+    @property
+    def visible(self) -> int:
+        return -(-self.height // self.row_height)
+
+    def row_html(self, item: Any) -> Markup:
+        key = self.key_fn(item) if self.key_fn is not None else item
+        try:
+            with self._lock:
+                html = self._cache.get(key)
+                if html is not None:
+                    self._cache.move_to_end(key)
+                    return html
+        except TypeError:
+            return self._render(item)
+        html = self._render(item)
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return html
+
+    def _render(self, item: Any) -> Markup:
+        ids = IdAllocator(f'{self.element_id}-{next(self._scopes)}')
+        return Markup(render_htmx(self.row_fn(item), self.minify, ids))
+
+    def window(self, count: int, start: int) -> tuple[int, int]:
+        """First and last (exclusive) row rendered for a scroll position of start rows"""
+        start = max(min(start, count - self.visible), 0)
+        return max(start - self.overscan, 0), min(start + self.visible + self.overscan, count)
+
+    def body(self, items: Sequence[Any], start: int, table: bool) -> List[Any]:
+        """Children of the scrolled element: spacers for the rows above and below and the rows in between"""
+        first, last = self.window(len(items), start)
+        return [_spacer(first * self.row_height, table),
+                *[self.row_html(items[index]) for index in range(first, last)],
+                _spacer((len(items) - last) * self.row_height, table)]
+
+
+def _spacer(height: int, table: bool) -> Element:
+    style = f'height:{height}px'
+    if table:
+        return Element('tr', {'aria-hidden': 'true', 'style': style}, [Element('td', {'style': 'padding:0;border:0'}, [])])
+    return Element('div', {'aria-hidden': 'true', 'style': style}, [])
+
+
+# scroll positions of the virtual elements of the session whose view is rendered
+_virtual_starts: ContextVar[Union[Dict[str, int], None]] = ContextVar('fasttea_virtual_starts', default=None)
+
+
+def virtual_element(source: RowSource, model: Any, attributes: Dict[str, Any],
+                    header: Union[Element, List[Element], None], table: bool) -> Element:
+    """Scroll container with the visible window of the rows of source"""
+    starts = _virtual_starts.get()
+    start = starts.get(source.name, 0) if starts is not None else 0
+    body_id = source.element_id + '-body'
+    container = {
+        'id': source.element_id,
+        'style': f'height:{source.height}px;overflow-y:auto',
+        'hx-get': f'/_fasttea/rows/{source.name}/{"table" if table else "list"}',
+        # a new container starts scrolled to the top, the window of another position is replaced
+        'hx-trigger': f'scroll throttle:50ms, load[document.getElementById("{body_id}").dataset.start !== "0"]',
+        'hx-sync': 'this:replace',
+        'hx-target': f'#{body_id}',
+        'hx-swap': 'innerHTML',
+        'hx-vals': f'js:{{"start": Math.floor(document.getElementById("{source.element_id}").scrollTop '
+                   f'/ {source.row_height})}}',
+    }
+    rows = source.body(source.items_fn(model), start, table)
+    if not table:
+        return Element('div', container, Element('div', {**attributes, 'id': body_id, 'data-start': start}, rows))
+    children = [Element('thead', {}, header)] if header is not None else []
+    children.append(Element('tbody', {'id': body_id, 'data-start': start}, rows))
+    return Element('div', container, Element('table', attributes, children))
+
+
+# endregion
+
+# region effects
+class Effect:
+    """Server side handler of a Cmd, its result is fed back into update as a Msg"""
+
+    def __init__(self, action: str, handler: Callable, timeout: Union[float, None], process: bool,
+                 on_error: Union[str, None]):
+        self.action = action
+        self.handler = handler
+        self.timeout = timeout
+        self.process = process
+        self.on_error = on_error
+
+    def result_msg(self, cmd: Cmd, result: Any) -> Union[Msg, None]:
+        if isinstance(result, Msg):
+            return result
+        if cmd.return_msg is not None:
+            return Msg(action=cmd.return_msg.action, value=result)
+        return None
 
 
 # endregion
@@ -132,22 +762,85 @@ class HtmlBubble:
 
 #endregion
 
+# stamps of renders, the client drops a full render older than the one it shows and loads the
+# whole view again when patches don't apply to the view it shows
+RENDER_HEADER = 'X-FastTEA-Render'
+BASE_HEADER = 'X-FastTEA-Base'
+
+
+def _stamp(session: Session) -> int:
+    """New stamp of the view of session, in microseconds so JavaScript numbers hold it exactly"""
+    session.rendered = max(time.time_ns() // 1000, session.rendered + 1)
+    return session.rendered
+
+
+# attempts to apply messages while other workers change the same session
+SAVE_ATTEMPTS = 3
+
+
 class FastTEA:
     def __init__(self, initial_model: Model,
                  css_framework: CSSFramework = CSSFramework.NONE,
                  js_libraries: List[str] = [],
                  css_additional: List[str] = [],
-                 debug=False):
+                 debug=False,
+                 session_backend: Union[SessionBackend, None] = None,
+                 diff: bool = True,
+                 lazy_cache_size: int = 256,
+                 static_dir: str = './static',
+                 static_path: str = '/static',
+                 transport: Transport = Transport.HTTP,
+                 blocking_workers: int = 8,
+                 max_effects: int = 64,
+                 coalesce_ms: int = 0,
+                 history: int = 0,
+                 metrics: bool = False,
+                 instruments: List[Instrument] = [],
+                 compress: bool = True,
+                 compress_min_size: int = 1024,
+                 minify: bool = False,
+                 stream_chunk_size: int = 16384):
         self.app = FastAPI()
-        self.model = initial_model
+        if compress:
+            # gzip or brotli for fragments, the shell and the app bundle, see fasttea.compression
+            self.app.add_middleware(CompressionMiddleware, minimum_size=compress_min_size)
+        # whitespace of text collapsed by the renderer
+        self.minify = minify
+        # views larger than one chunk are streamed by /init
+        self.stream_chunk_size = stream_chunk_size
+        self.initial_model = initial_model
+        self.sessions: SessionBackend = session_backend or MemorySessionBackend()
         self.update_fn: Callable[[Msg, Model], tuple[Model, Union[Cmd, None]]] = lambda msg, model: (model, None)
         self.view_fn: Callable[[Model], Element] = lambda model: Element("div", {}, [])
+        self.update_blocking = False
+        self.view_blocking = False
+        self.subscription_fn: Union[Callable[[Model], List[Sub]], None] = None
         self.css_framework = css_framework
         self.js_libraries = js_libraries
         self.css_additional = css_additional
         self.html_bubbles: List[HtmlBubble] = []
         self.cmd_handlers: Dict[str, Callable] = {}  #dictionary to store command handlers
+        self.effects: Dict[str, Effect] = {}  # server side command handlers
+        self.row_sources: Dict[str, RowSource] = {}  # rows of virtual tables and lists
         self.debug = debug
+        self._shell: Union[tuple[bytes, str], None] = None
+        self._js_bundle: tuple[bytes, str] = (b'', '')
+        self.diff = diff
+        self.lazy_cache_size = lazy_cache_size
+        self.static_files = StaticFiles(static_dir, static_path)
+        self.transport = transport
+        # window in which the client collects messages before sending them in one request
+        self.coalesce_ms = coalesce_ms
+        # number of messages logged per session for time travel debugging, 0 disables the log
+        self.history = history
+        # hooks around the phases of a request, see fasttea.metrics
+        self.metrics = Metrics() if metrics else None
+        self.instruments: List[Instrument] = list(instruments) + ([self.metrics] if metrics else [])
+        # bounded pool for update and view functions declared as blocking
+        self.executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='fasttea')
+        self._process_pool: Union[ProcessPoolExecutor, None] = None
+        self._effect_slots = asyncio.Semaphore(max_effects)
+        self._effect_tasks: set = set()
 
         file_path = './.fasttea/security.toml'
         self.security = {}
@@ -161,116 +854,685 @@ class FastTEA:
                 print(f"Reading file: {e}")
 
         @self.app.get("/", response_class=HTMLResponse)
-        async def root():
+        async def root(request: Request):
             if self.debug: print('fastTEA root')
-            css_link = self._get_css_link()
-            css_links = self._get_css_links()
-            js_links = self._get_js_links()
-            js_links_from_html_bubbles = self._get_js_links_from_html_bubbles()
-            value = f"""
-                <html>
-                <head>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <script src="https://unpkg.com/htmx.org@2.0.2"></script>
-                    {css_link}
-                    {css_links}
-                    {js_links}
-                    {js_links_from_html_bubbles}
-                    <title>fastTEA Application</title>
-                </head>
-                 <body>
-                        <main class="container">
-                            <div id="app" hx-get="/init" hx-trigger="load, update from:body"></div>
-                        </main>
-                        <script>
-                            // Helper function for triggering HTMX events with message data
-                           function triggerMsg(action, value) {{
-                                htmx.ajax('POST', '/update', {{
-                                    target: '#app',
-                                    swap: 'innerHTML',
-                                    values: {{
-                                        action: action,
-                                        value: value
-                                    }}
-                                }});
-                            }}
-                            
-                            {self.html_bubble_classes_js}
-                            {self.generate_cmd_handlers_js}
-                            const app = {{
-                                executeCmd(cmd) {{
-                                    if (cmd.action in this.cmdHandlers) {{
-                                        const result = this.cmdHandlers[cmd.action](cmd.payload);
-                                        // If command handler returns a message definition, send it
-                                        if (result && result.msg) {{
-                                            triggerMsg(result.msg.action, result.msg.value);
-                                        }}
-                                    }} else {{
-                                        console.error(`No handler for command: ${{cmd.action}}`);
-                                    }}
-                                }},
-                                cmdHandlers: {{}}
-                            }};
-                            {self.add_cmd_handlers_js}
-                            document.body.addEventListener('htmx:afterOnLoad', function(event) {{
-                                const cmdData = event.detail.xhr.getResponseHeader('HX-Trigger');
-                                if (cmdData) {{
-                                    const cmd = JSON.parse(cmdData);
-                                    app.executeCmd(cmd);
-                                }}
-                            }});
-                        </script>
-                        {self._get_js_link()}
-                    </body>
-                </html>
-                """
-            if self.debug:
-                print(f'FastTEA root {value}')
-            return value
-
-        @self.app.get("/init")
-        async def init():
-            view_element = self.view_fn(self.model)
-            return HTMLResponse(f"""
-                                {view_element.to_htmx()}
-                            """)
+            body, etag = self._get_shell()
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag_matches(request.headers.get('if-none-match'), etag):
+                return Response(status_code=304, headers=headers)
+            return Response(body, media_type="text/html; charset=utf-8", headers=headers)
 
-        @self.app.get("/static/{file_path:path}")
-        async def get_file(file_path: str):
-            base_path = "./static/"  # static path
+        @self.app.get("/_fasttea/app.{digest}.js")
+        async def js_bundle(digest: str):
+            script, current = self._get_js_bundle()
+            if digest != current:
+                raise HTTPException(status_code=404, detail=f"Bundle {digest} not found")
+            return Response(script, media_type="text/javascript; charset=utf-8",
+                            headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
 
-            full_path = os.path.join(base_path, file_path)
+        @self.app.get("/init")
+        async def init(request: Request):
+            session, created = self._get_session(request)
+            if self.instruments:
+                self._before('request', session.id, None)
+                started = time.perf_counter()
+            async with session.lock:
+                view_element = await self._view(session)
+                session.view = view_element
+                stamp = _stamp(session)
+                # lazy nodes touch the session, the rest of the tree is serialized after the lock
+                _resolve_lazy(view_element)
+                chunks = view_element.iter_htmx(self.stream_chunk_size, self.minify)
+                first = next(chunks, '')
+                second = next(chunks, None)
+            if second is None:
+                response = HTMLResponse(first)
+                if self.instruments:
+                    self._measure_response('/init', len(response.body))
+                    self._after('request', session.id, None, time.perf_counter() - started)
+            else:
+                # large views are sent while the rest of the tree is serialized
+                async def stream():
+                    size = 0
+                    for chunk in itertools.chain((first, second), chunks):
+                        size += len(chunk)
+                        yield chunk
+                    if self.instruments:
+                        self._measure_response('/init', size)
+                        self._after('request', session.id, None, time.perf_counter() - started)
 
-            if not os.path.isfile(full_path):
-                raise HTTPException(status_code=404, detail=f"File {full_path} not found")
+                response = StreamingResponse(stream(), media_type="text/html; charset=utf-8")
+            response.headers[RENDER_HEADER] = str(stamp)
+            self._save_session(session, created, response)
+            return response
 
-            return FileResponse(full_path)
+        @self.app.get(self.static_files.mount_path + "/{file_path:path}")
+        async def get_file(file_path: str, request: Request):
+            static_file = self.static_files.lookup(file_path)
+            if static_file is None:
+                raise HTTPException(status_code=404, detail=f"File {file_path} not found")
+            return self.static_files.response(static_file, request.headers)
 
         @self.app.post("/update")
         async def update(request: Request):
             #content_type = request.headers.get('Content-Type', '')
             #print(f'content type {content_type}')
 
+            session, created = self._get_session(request)
+            if self.instruments:
+                self._before('request', session.id, None)
+                self._before('parse', session.id, None)
+                started = time.perf_counter()
             form_data = await request.form()
             #print(f'form {form_data}')
             action = form_data.get("action")
             value = form_data.get("value")
             #print(f'action {action}')
             #print(f'value {value}')
-            msg = Msg(action=action, value=value)
-            new_model, cmd = self.update_fn(msg, self.model)
-            self.model = new_model
-            view_element = self.view_fn(self.model)
-            response = HTMLResponse(view_element.to_htmx())
+            messages = form_data.get("messages")
+            if messages:
+                # coalesced messages of the client
+                msgs = [Msg(**message) for message in json.loads(messages)]
+            else:
+                msgs = [Msg(action=action, value=value)]
+            if self.instruments:
+                self._after('parse', session.id, None, time.perf_counter() - started)
+            try:
+                html, patched, cmd, stamps = await self._process(session, msgs, request.headers.get('HX-Target') == 'app')
+            except SessionConflictError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            response = HTMLResponse(html)
+            response.headers[RENDER_HEADER] = str(stamps[0])
+            if patched:
+                response.headers["HX-Reswap"] = "none"
+                response.headers[BASE_HEADER] = str(stamps[1])
             if cmd:
                 response.headers["HX-Trigger"] = cmd.json()
+            # _process saved the session
+            if created:
+                self._set_cookie(session, response)
+            if self.instruments:
+                self._measure_response('/update', len(response.body))
+                self._after('request', session.id, None, time.perf_counter() - started)
             return response
 
+        if self.metrics is not None:
+            @self.app.get("/_fasttea/metrics")
+            async def metrics():
+                return Response(self.metrics.exposition(), media_type=METRICS_CONTENT_TYPE)
+
+        if self.history:
+            @self.app.get("/_fasttea/history")
+            async def history_log(request: Request):
+                session_id = request.cookies.get(SESSION_COOKIE)
+                log = self.export_history(session_id) if session_id else None
+                if log is None:
+                    raise HTTPException(status_code=404, detail="No session")
+                return log
+
+        @self.app.get("/_fasttea/rows/{name}/{kind}")
+        async def rows(name: str, kind: str, request: Request, start: int = 0):
+            source = self.row_sources.get(name)
+            session_id = request.cookies.get(SESSION_COOKIE)
+            session = self.sessions.load(session_id) if session_id else None
+            if source is None or session is None or kind not in ('table', 'list'):
+                raise HTTPException(status_code=404, detail=f"Rows {name} not found")
+            async with session.lock:
+                # the next view renders the same window, so patches of the view keep the scroll position
+                session.virtual_starts[name] = start
+                body = source.body(source.items_fn(session.model), start, kind == 'table')
+            return HTMLResponse(''.join(child if isinstance(child, Markup) else child.to_htmx(self.minify)
+                                        for child in body))
+
+        @self.app.websocket("/_fasttea/ws")
+        async def websocket_endpoint(websocket: WebSocket):
+            session_id = websocket.cookies.get(SESSION_COOKIE)
+            await websocket.accept()
+            session = self.sessions.load(session_id) if session_id else None
+            if session is None:
+                # the client falls back to HTTP, which creates a new session
+                await websocket.close(code=4001)
+                return
+            self._connect(session, websocket.send_json)
+            try:
+                while True:
+                    data = await websocket.receive_json()
+                    session = self.sessions.load(session_id)
+                    if session is None:
+                        await websocket.close(code=4001)
+                        return
+                    if self.instruments:
+                        self._before('request', session_id, None)
+                        self._before('parse', session_id, None)
+                        started = time.perf_counter()
+                    if "messages" in data:
+                        msgs = [Msg(**message) for message in data["messages"]]
+                    else:
+                        msgs = [Msg(action=data.get("action"), value=data.get("value"))]
+                    if self.instruments:
+                        self._after('parse', session_id, None, time.perf_counter() - started)
+                    try:
+                        html, patched, cmd, stamps = await self._process(session, msgs, True)
+                    except SessionConflictError as e:
+                        # the client falls back to HTTP and loads the stored state with /init
+                        print(f"Messages dropped: {e}")
+                        await websocket.close(code=4009)
+                        return
+                    await websocket.send_json(self._frame(html, patched, cmd, stamps))
+                    if self.instruments:
+                        self._measure_response('/_fasttea/ws', len(html))
+                        self._after('request', session_id, None, time.perf_counter() - started)
+            except WebSocketDisconnect:
+                pass
+            finally:
+                self._disconnect(session, websocket.send_json)
+
+        @self.app.get("/_fasttea/events")
+        async def events(request: Request):
+            session_id = request.cookies.get(SESSION_COOKIE)
+            session = self.sessions.load(session_id) if session_id else None
+            if session is None:
+                raise HTTPException(status_code=404, detail="No session")
+            queue: asyncio.Queue = asyncio.Queue()
+
+            async def send(frame: dict):
+                queue.put_nowait(frame)
+
+            async def stream():
+                self._connect(session, send)
+                try:
+                    while True:
+                        try:
+                            frame = await asyncio.wait_for(queue.get(), 15)
+                        except asyncio.TimeoutError:
+                            if await request.is_disconnected():
+                                return
+                            yield ": keep-alive\n\n"
+                            continue
+                        yield f"data: {json.dumps(frame)}\n\n"
+                finally:
+                    self._disconnect(session, send)
+
+            return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    def _frame(self, html: str, patched: bool, cmd: Union[Cmd, None], stamps: tuple[int, Union[int, None]]) -> dict:
+        """Message of the WebSocket and server sent event transports"""
+        return {
+            "swap": "oob" if patched else "app",
+            "html": html,
+            "cmd": cmd.model_dump(mode="json") if cmd else None,
+            "render": stamps[0],
+            "base": stamps[1],
+        }
+
+    def _connect(self, session: Session, send: Callable[[dict], Any]):
+        session.connections.append(send)
+        if self.subscription_fn is not None and session.subscriptions is None:
+            session_id = session.id
+
+            async def dispatch(action: str, value: Any):
+                await self._push_msg(session_id, Msg(action=action, value=value))
+
+            session.subscriptions = SubscriptionRunner(dispatch)
+            session.subscriptions.update(self.subscription_fn(session.model))
+
+    def _disconnect(self, session: Session, send: Callable[[dict], Any]):
+        if send in session.connections:
+            session.connections.remove(send)
+        if not session.connections and session.subscriptions is not None:
+            session.subscriptions.stop()
+            session.subscriptions = None
+
+    async def _push_msg(self, session_id: str, msg: Msg):
+        """Apply a message which doesn't come from the client and push the result to its connections"""
+        session = self.sessions.load(session_id)
+        if session is None:
+            return
+        # without connections (not yet open, dropped or held by another worker) nobody gets a frame
+        connected = bool(session.connections)
+        try:
+            html, patched, cmd, stamps = await self._process(session, [msg], True, render=connected)
+        except SessionConflictError as e:
+            print(f"Message {msg.action} dropped: {e}")
+            return
+        if not connected:
+            return
+        if self.instruments:
+            self._measure_response('push', len(html))
+        frame = self._frame(html, patched, cmd, stamps)
+        delivered = False
+        for send in list(session.connections):
+            try:
+                await send(frame)
+                delivered = True
+            except Exception as e:
+                print(f"Push to session {session_id} failed: {e}")
+                self._disconnect(session, send)
+        if not delivered:
+            session.view = None
+
+    async def _process(self, session: Session, msgs: List[Msg], targets_app: bool,
+                       render: bool = True) -> tuple[str, bool, Union[Cmd, None], tuple[int, Union[int, None]]]:
+        """Fold messages through update and render once
+
+        Returns the HTML, whether it consists of patches, the cmd for the browser and the stamps of
+        the render and of the view the patches apply to. Without render the view is only forgotten.
+        Messages of one session are applied one after the other.
+        """
+        timed = self.history or self.instruments
+        async with session.lock:
+            for attempt in range(SAVE_ATTEMPTS):
+                previous = session.model
+                cmds, entry = await self._apply(session, msgs, timed)
+                if self.sessions.save(session) is not False:
+                    break
+                # another worker wrote the session since it was loaded, the messages go to its model
+                if self.history:
+                    session.history.discard(len(msgs))
+                stored = self.sessions.load(session.id)
+                if stored is None or attempt == SAVE_ATTEMPTS - 1:
+                    raise SessionConflictError(f"Session {session.id} was changed by another worker")
+                session.model, session.version, session.view = stored.model, stored.version, None
+            base = session.rendered
+            if not render:
+                # nobody receives the HTML, the next response renders the whole view
+                if session.subscriptions is not None:
+                    session.subscriptions.update(self.subscription_fn(session.model))
+                session.view = None
+                html, patched = '', False
+            elif (session.model is previous and isinstance(previous, ImmutableModel)
+                    and self.diff and targets_app and session.view is not None):
+                # an immutable model which wasn't evolved renders the view the client already shows
+                html, patched = '', True
+            else:
+                if session.subscriptions is not None:
+                    session.subscriptions.update(self.subscription_fn(session.model))
+                if not timed:
+                    html, patched = self._render(session, await self._view(session), targets_app)
+                else:
+                    self._before('view', session.id, None)
+                    started = time.perf_counter()
+                    view_element = await self._view(session)
+                    rendered = time.perf_counter()
+                    self._after('view', session.id, None, rendered - started)
+                    self._before('render', session.id, None)
+                    html, patched = self._render(session, view_element, targets_app)
+                    elapsed = time.perf_counter() - rendered
+                    self._after('render', session.id, None, elapsed)
+                    if entry is not None:
+                        entry.view_ms = (rendered - started) * 1000
+                        entry.render_ms = elapsed * 1000
+            stamps = (session.rendered, base if patched else None)
+        browser_cmds = []
+        for cmd in cmds:
+            if cmd.action in self.effects:
+                self._start_effect(session.id, cmd)
+            else:
+                browser_cmds.append(cmd)
+        if len(browser_cmds) > 1:
+            return html, patched, Cmd.batch(browser_cmds), stamps
+        return html, patched, browser_cmds[0] if browser_cmds else None, stamps
+
+    async def _apply(self, session: Session, msgs: List[Msg], timed: bool) -> tuple[List[Cmd], Any]:
+        """Fold messages through update, returns the cmds and the history entry of the last message"""
+        cmds: List[Cmd] = []
+        entry = None
+        for msg in msgs:
+            if timed:
+                if self.history:
+                    entry = self._record(session, msg)
+                self._before('update', session.id, msg.action)
+                started = time.perf_counter()
+            new_model, cmd = await self._call(self.update_fn, self.update_blocking, msg, session.model)
+            session.model = new_model
+            if timed:
+                elapsed = time.perf_counter() - started
+                self._after('update', session.id, msg.action, elapsed)
+                if entry is not None:
+                    entry.update_ms = elapsed * 1000
+                    entry.cmd = cmd
+            if cmd is not None:
+                cmds.extend(cmd.flat())
+        return cmds, entry
+
+    def _before(self, phase: str, session_id: str, action: Union[str, None]):
+        for instrument in self.instruments:
+            instrument.before(phase, session_id, action)
+
+    def _after(self, phase: str, session_id: str, action: Union[str, None], seconds: float):
+        for instrument in self.instruments:
+            instrument.after(phase, session_id, action, seconds)
+
+    def _measure_response(self, path: str, size: int):
+        for instrument in self.instruments:
+            instrument.response(path, size)
+
+    def _record(self, session: Session, msg: Msg):
+        if session.history is None:
+            session.history = MessageLog(self.history)
+        return session.history.record(msg, session.model)
+
+    def export_history(self, session_id: str) -> Union[dict, None]:
+        """Message log of a session as JSON data, see fasttea.history.replay"""
+        session = self.sessions.load(session_id)
+        if session is None or session.history is None:
+            return None
+        return session.history.export(session.model)
+
+    def _start_effect(self, session_id: str, cmd: Cmd):
+        task = asyncio.create_task(self._run_effect(session_id, self.effects[cmd.action], cmd))
+        # the running effects are kept, otherwise the tasks could be garbage collected
+        self._effect_tasks.add(task)
+        task.add_done_callback(self._effect_tasks.discard)
+
+    async def _run_effect(self, session_id: str, effect: Effect, cmd: Cmd):
+        async with self._effect_slots:
+            try:
+                if inspect.iscoroutinefunction(effect.handler):
+                    call = effect.handler(cmd.payload)
+                else:
+                    if effect.process and self._process_pool is None:
+                        self._process_pool = ProcessPoolExecutor()
+                    executor = self._process_pool if effect.process else self.executor
+                    call = asyncio.get_running_loop().run_in_executor(executor, effect.handler, cmd.payload)
+                result = await asyncio.wait_for(call, effect.timeout)
+                msg = effect.result_msg(cmd, result)
+            except Exception as e:
+                print(f"Effect {effect.action} failed: {e!r}")
+                msg = Msg(action=effect.on_error, value=repr(e)) if effect.on_error else None
+        if msg is not None:
+            await self._push_msg(session_id, msg)
+
+    async def _view(self, session: Session) -> Element:
+        """Run the view function with the lazy cache of the session"""
+        if session.lazy_cache is None:
+            session.lazy_cache = LazyCache(self.lazy_cache_size, self.minify)
+        session.lazy_cache.begin_view()
+        token = _lazy_cache.set(session.lazy_cache)
+        starts_token = _virtual_starts.set(session.virtual_starts)
+        try:
+            return await self._call(self.view_fn, self.view_blocking, session.model)
+        finally:
+            _virtual_starts.reset(starts_token)
+            _lazy_cache.reset(token)
+
+    async def _call(self, fn: Callable, blocking: bool, *args):
+        """Await async functions, run blocking ones in the thread pool and all others inline"""
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args)
+        if blocking:
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, fn, *args)
+        return fn(*args)
+
+    def _render(self, session: Session, view_element: Element, targets_app: bool) -> tuple[str, bool]:
+        """Only the changed fragments as out of band swaps if the client shows the last view in #app"""
+        previous = session.view if self.diff and targets_app else None
+        # a swap into another target leaves #app in a state we don't know
+        session.view = view_element if targets_app else None
+        _stamp(session)
+        if previous is not None:
+            patches = diff_elements(previous, view_element)
+            if patches is not None:
+                return oob_htmx(patches, self.minify), True
+        return view_element.to_htmx(self.minify), False
+
+    def _get_session(self, request: Request) -> tuple[Session, bool]:
+        """Session of the requesting client, a new one is created from the initial model if needed"""
+        session_id = request.cookies.get(SESSION_COOKIE)
+        session = self.sessions.load(session_id) if session_id else None
+        if session is not None:
+            return session, False
+        return Session(new_session_id(), copy_model(self.initial_model)), True
+
+    def _save_session(self, session: Session, created: bool, response):
+        # a conflict leaves the newer session of another worker in place, the model wasn't changed here
+        self.sessions.save(session)
+        if created:
+            self._set_cookie(session, response)
+
+    def _set_cookie(self, session: Session, response):
+        response.set_cookie(SESSION_COOKIE, session.id, httponly=True, samesite="lax")
+
     def add_html_bubble(self, bubble: HtmlBubble) -> HtmlBubble:
         self.html_bubbles.append(bubble)
+        self._shell = None
         return bubble
 
+    def freeze(self):
+        """Build the HTML shell of the root route, later registrations build it again"""
+        self._get_shell()
+
+    def _get_shell(self) -> tuple[bytes, str]:
+        if self._shell is None:
+            script = self._build_js_bundle().encode('utf-8')
+            self._js_bundle = (script, content_hash(script))
+            value = self._build_shell()
+            if self.debug:
+                print(f'FastTEA root {value}')
+            body = value.encode('utf-8')
+            self._shell = (body, strong_etag(body))
+        return self._shell
+
+    def _get_js_bundle(self) -> tuple[bytes, str]:
+        self._get_shell()
+        return self._js_bundle
+
+    def _build_shell(self) -> str:
+        css_link = self._get_css_link()
+        css_links = self._get_css_links()
+        js_links = self._get_js_links()
+        js_links_from_html_bubbles = self._get_js_links_from_html_bubbles()
+        value = f"""
+            <html>
+            <head>
+                <meta charset="UTF-8">
+                <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                <script src="https://unpkg.com/htmx.org@2.0.2"></script>
+                {css_link}
+                {css_links}
+                {js_links}
+                {js_links_from_html_bubbles}
+                <title>fastTEA Application</title>
+            </head>
+             <body>
+                    <main class="container">
+                        <div id="app" hx-get="/init" hx-trigger="load, update from:body"></div>
+                    </main>
+                    <script src="/_fasttea/app.{self._js_bundle[1]}.js"></script>
+                    {self._get_js_link()}
+                </body>
+            </html>
+            """
+        return value
+
+    def _build_js_bundle(self) -> str:
+        """Bubble classes and cmd handlers, served as one content hashed asset"""
+        return f"""
+// Helper function for triggering HTMX events with message data
+function triggerMsg(action, value) {{
+    if (fastteaQueue.delay > 0) {{
+        fastteaQueue.push(action, value);
+        return;
+    }}
+    if (fastteaSocket.ready()) {{
+        fastteaSocket.send(action, value);
+        return;
+    }}
+    htmx.ajax('POST', '/update', {{
+        target: '#app',
+        swap: 'innerHTML',
+        values: {{
+            action: action,
+            value: value
+        }}
+    }});
+}}
+
+{self.html_bubble_classes_js}
+{self.generate_cmd_handlers_js}
+const app = {{
+    executeCmd(cmd) {{
+        if (cmd.action === '{BATCH_ACTION}') {{
+            cmd.cmds.forEach((batched) => this.executeCmd(batched));
+        }} else if (cmd.action in this.cmdHandlers) {{
+            const result = this.cmdHandlers[cmd.action](cmd.payload);
+            // If command handler returns a message definition, send it
+            if (result && result.msg) {{
+                triggerMsg(result.msg.action, result.msg.value);
+            }}
+        }} else {{
+            console.error(`No handler for command: ${{cmd.action}}`);
+        }}
+    }},
+    cmdHandlers: {{}}
+}};
+{self.add_cmd_handlers_js}
+document.body.addEventListener('htmx:afterOnLoad', function(event) {{
+    const cmdData = event.detail.xhr.getResponseHeader('HX-Trigger');
+    if (cmdData) {{
+        const cmd = JSON.parse(cmdData);
+        app.executeCmd(cmd);
+    }}
+}});
+{self._socket_js}
+"""
+
+    @property
+    def _socket_js(self):
+        """Client of the WebSocket transport, messages for #app are sent over the socket once it is open"""
+        return f"""
+const fastteaSocket = {{
+    enabled: {'true' if self.transport == Transport.WEBSOCKET else 'false'},
+    socket: null,
+    events: null,
+    connect() {{
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${{protocol}}//${{location.host}}/_fasttea/ws`);
+        socket.onmessage = (event) => this.receive(JSON.parse(event.data));
+        socket.onclose = (event) => {{
+            this.socket = null;
+            if (event.code === 4009) {{
+                // messages of a conflicting session write were dropped by the server
+                htmx.ajax('GET', '/init', {{target: '#app', swap: 'innerHTML'}});
+            }}
+        }};
+        this.socket = socket;
+    }},
+    ready() {{
+        return this.socket !== null && this.socket.readyState === WebSocket.OPEN;
+    }},
+    send(action, value) {{
+        this.socket.send(JSON.stringify({{action: action, value: value}}));
+    }},
+    receive(data) {{
+        if (!fastteaRender.accept(data.render, data.base)) {{
+            if (data.cmd) {{
+                app.executeCmd(data.cmd);
+            }}
+            return;
+        }}
+        if (data.swap === 'app') {{
+            const target = document.getElementById('app');
+            target.innerHTML = data.html;
+            htmx.process(target);
+        }} else {{
+            const template = document.createElement('template');
+            template.innerHTML = data.html;
+            for (const fragment of Array.from(template.content.children)) {{
+                const current = document.getElementById(fragment.id);
+                if (current) {{
+                    fragment.removeAttribute('hx-swap-oob');
+                    current.replaceWith(fragment);
+                    htmx.process(fragment);
+                }}
+            }}
+        }}
+        if (data.cmd) {{
+            app.executeCmd(data.cmd);
+        }}
+    }}
+}};
+// responses and pushed frames may arrive out of order
+const fastteaRender = {{
+    current: 0,
+    accept(render, base) {{
+        if (base === null || base === undefined) {{
+            if (render < this.current) {{
+                return false;
+            }}
+        }} else if (base !== this.current) {{
+            htmx.ajax('GET', '/init', {{target: '#app', swap: 'innerHTML'}});
+            return false;
+        }}
+        this.current = render;
+        return true;
+    }}
+}};
+document.body.addEventListener('htmx:beforeSwap', function(event) {{
+    const render = event.detail.xhr.getResponseHeader('{RENDER_HEADER}');
+    if (render === null || event.detail.target.id !== 'app') {{
+        return;
+    }}
+    const base = event.detail.xhr.getResponseHeader('{BASE_HEADER}');
+    if (!fastteaRender.accept(Number(render), base === null ? null : Number(base))) {{
+        event.detail.shouldSwap = false;
+    }}
+}});
+// messages within the coalesce window are sent together and rendered once
+const fastteaQueue = {{
+    delay: {self.coalesce_ms},
+    messages: [],
+    timer: null,
+    push(action, value) {{
+        this.messages.push({{action: action, value: value}});
+        if (this.timer === null) {{
+            this.timer = setTimeout(() => this.flush(), this.delay);
+        }}
+    }},
+    flush() {{
+        const messages = this.messages;
+        this.messages = [];
+        this.timer = null;
+        if (fastteaSocket.ready()) {{
+            fastteaSocket.socket.send(JSON.stringify({{messages: messages}}));
+        }} else {{
+            htmx.ajax('POST', '/update', {{
+                target: '#app',
+                swap: 'innerHTML',
+                headers: {{'X-FastTEA-Batch': 'true'}},
+                values: {{messages: JSON.stringify(messages)}}
+            }});
+        }}
+    }}
+}};
+document.body.addEventListener('htmx:configRequest', function(event) {{
+    if (event.detail.path !== '/update' || event.detail.target.id !== 'app' || event.detail.headers['X-FastTEA-Batch']) {{
+        return;
+    }}
+    if (fastteaQueue.delay > 0) {{
+        event.preventDefault();
+        fastteaQueue.push(event.detail.parameters['action'], event.detail.parameters['value']);
+    }} else if (fastteaSocket.ready()) {{
+        event.preventDefault();
+        fastteaSocket.send(event.detail.parameters['action'], event.detail.parameters['value']);
+    }}
+}});
+document.body.addEventListener('htmx:afterOnLoad', function(event) {{
+    // the session cookie exists once /init was loaded
+    if (event.detail.pathInfo.requestPath !== '/init') {{
+        return;
+    }}
+    if (fastteaSocket.enabled && fastteaSocket.socket === null) {{
+        fastteaSocket.connect();
+    }} else if (!fastteaSocket.enabled && {'true' if self.subscription_fn or self.effects else 'false'} && !fastteaSocket.events) {{
+        // results of subscriptions and effects are pushed as server sent events
+        fastteaSocket.events = new EventSource('/_fasttea/events');
+        fastteaSocket.events.onmessage = (message) => fastteaSocket.receive(JSON.parse(message.data));
+    }}
+}});
+"""
+
     @property
     def add_cmd_handlers_js(self):
         handlers = {}
@@ -295,21 +1557,66 @@ class FastTEA:
             instances.append(f"app.{i.name} = new {i.class_name}();")
         return "; ".join(instances)
 
-    def update(self, update_fn: Callable[[Msg, Model], tuple[Model, Union[Cmd, None]]]):
-        """Decorator to set the update function"""
-        self.update_fn = update_fn
-        return update_fn
+    def update(self, update_fn: Union[Callable[[Msg, Model], tuple[Model, Union[Cmd, None]]], None] = None, *,
+               blocking: bool = False):
+        """Decorator to set the update function, it may be async
 
-    def view(self, view_fn: Callable[[Model], Element]):
-        """Decorator to set the view function"""
-        self.view_fn = view_fn
-        return view_fn
+        Use @app.update(blocking=True) for a sync function which blocks (database, files),
+        it runs in the thread pool instead of the event loop.
+        """
+        def decorator(f: Callable):
+            self.update_fn = f
+            self.update_blocking = blocking
+            return f
+
+        return decorator(update_fn) if update_fn is not None else decorator
+
+    def subscription(self, subscription_fn: Callable[[Model], List[Sub]]):
+        """Decorator to set the subscription function, it returns the subscriptions for a model"""
+        self.subscription_fn = subscription_fn
+        self._shell = None
+        return subscription_fn
+
+    def view(self, view_fn: Union[Callable[[Model], Element], None] = None, *, blocking: bool = False):
+        """Decorator to set the view function, it may be async or blocking like the update function"""
+        def decorator(f: Callable):
+            self.view_fn = f
+            self.view_blocking = blocking
+            return f
+
+        return decorator(view_fn) if view_fn is not None else decorator
+
+    def virtual_rows(self, name: str, items_fn: Callable[[Model], Sequence[Any]], row_fn: Callable[[Any], Element],
+                     row_height: int = 32, height: int = 480, overscan: int = 10,
+                     key_fn: Union[Callable[[Any], Any], None] = None, cache_size: int = 10000) -> RowSource:
+        """Rows for virtual_table and virtual_list, items_fn picks the items of a model and row_fn renders one"""
+        source = RowSource(name, items_fn, row_fn, row_height, height, overscan, key_fn, cache_size, self.minify)
+        self.row_sources[name] = source
+        return source
 
     def cmd(self, action: str):
         """Decorator to handle cmd function"""
 
         def decorator(f: Callable):
             self.cmd_handlers[action] = f
+            self._shell = None
+            return f
+
+        return decorator
+
+    def effect(self, action: str, timeout: Union[float, None] = 30.0, process: bool = False,
+               on_error: Union[str, None] = None):
+        """Decorator for a server side cmd handler, e.g. HTTP calls or database queries
+
+        The handler gets the payload of the cmd and runs off the request path: async handlers as a task,
+        sync ones in the thread pool or with process=True in a process pool. A returned Msg, or the return_msg
+        of the cmd with the result as value, is applied and the view is pushed to the client.
+        On failure or timeout the message on_error gets the error as value.
+        """
+
+        def decorator(f: Callable):
+            self.effects[action] = Effect(action, f, timeout, process, on_error)
+            self._shell = None
             return f
 
         return decorator
@@ -325,7 +1632,8 @@ class FastTEA:
         for i in self.html_bubbles:
             for j in i.js_libraries:
                 js_libraries.append(j)
-        js_libraries = list(set(js_libraries))
+        # stable order, the shell and its ETag must be the same in every worker
+        js_libraries = list(dict.fromkeys(js_libraries))
         return '\n'.join([f'<script src="{lib}"></script>' for lib in js_libraries])
 
     def _get_css_links(self):
@@ -338,6 +1646,21 @@ class FastTEA:
         else:
             return ''
 
-    def run(self):
+    def run(self, host: str = "127.0.0.1", port: int = 5001, workers: int = 1, loop: str = "auto",
+            http: str = "auto", app_path: Union[str, None] = None, **uvicorn_options):
+        """Start uvicorn
+
+        loop is 'auto', 'asyncio' or 'uvloop', http is 'auto', 'h11' or 'httptools' ('auto' picks uvloop
+        and httptools if they are installed). More than one worker needs the import string of the FastAPI
+        app, e.g. app_path="main:app.app", and a session backend shared by the processes (see fasttea.backends).
+        """
         import uvicorn
-        uvicorn.run(self.app, host="127.0.0.1", port=5001)
+        self.freeze()
+        if workers > 1:
+            if app_path is None:
+                raise ValueError('run with workers > 1 needs app_path, the import string of the FastAPI app')
+            if isinstance(self.sessions, MemorySessionBackend):
+                print('Warning: every worker has its own MemorySessionBackend, use a backend from fasttea.backends')
+            uvicorn.run(app_path, host=host, port=port, workers=workers, loop=loop, http=http, **uvicorn_options)
+        else:
+            uvicorn.run(self.app, host=host, port=port, loop=loop, http=http, **uvicorn_options)
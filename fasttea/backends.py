@@ -0,0 +1,254 @@
+"""Session backends which share the models between worker processes and keep them across restarts"""
+import hashlib
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Optional, Type, Union
+
+from rich import print
+
+from .session import Session, SessionBackend
+from .snapshot import Snapshotter, SnapshotError
+
+
+class StoreBackend(SessionBackend):
+    """Base class for backends which keep serialized models outside the process
+
+    Subclasses implement read, write and remove, models are stored as compact snapshots (fasttea.snapshot).
+    Session objects with the process local state (last view, lazy cache, connections) are kept in a
+    bounded local cache, a new version written by another worker replaces the model and forgets the
+    view, since that worker rendered the client DOM. Writes compare the stored version with the
+    loaded one, so a worker never overwrites a model it hasn't seen.
+    """
+
+    def __init__(self, model_class: Type, local_sessions: int = 1000, idle_timeout: Union[float, None] = 3600.0,
+                 snapshots: Union[Snapshotter, None] = None):
+        self.model_class = model_class
+        self.snapshots = snapshots or Snapshotter(model_class)
+        self.local_sessions = local_sessions
+        self.idle_timeout = idle_timeout
+        self._local: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, session_id: str) -> Optional[tuple[str, bytes]]:
+        """Version and data of a stored session"""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def write(self, session_id: str, version: str, data: bytes, expected: Optional[str]) -> bool:
+        """Store data if the stored version is expected (None: no live session is stored), atomically"""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def remove(self, session_id: str) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def encode(self, model: Any) -> bytes:
+        return self.snapshots.dumps(model)
+
+    def decode(self, data: bytes) -> Any:
+        return self.snapshots.loads(data)
+
+    def load(self, session_id: str) -> Optional[Session]:
+        try:
+            return self._load(session_id)
+        except SnapshotError as e:
+            # a model changed without a new snapshot version, or corrupt data: the client gets a new session
+            print(f"Session {session_id} can't be restored: {e}")
+            self.delete(session_id)
+            return None
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        record = self.read(session_id)
+        with self._lock:
+            if record is None:
+                self._local.pop(session_id, None)
+                return None
+            version, data = record
+            session = self._local.get(session_id)
+            if session is None:
+                session = Session(session_id, self.decode(data))
+                session.version = version
+                self._local[session_id] = session
+                while len(self._local) > self.local_sessions:
+                    self._local.popitem(last=False)
+            elif session.version != version:
+                session.model = self.decode(data)
+                session.version = version
+                session.view = None
+            self._local.move_to_end(session_id)
+        return session
+
+    def save(self, session: Session) -> bool:
+        # random versions never collide, even if two workers write the same session
+        version = uuid.uuid4().hex
+        if not self.write(session.id, version, self.encode(session.model), session.version):
+            return False
+        session.version = version
+        with self._lock:
+            self._local[session.id] = session
+            self._local.move_to_end(session.id)
+            while len(self._local) > self.local_sessions:
+                self._local.popitem(last=False)
+        return True
+
+    def delete(self, session_id: str) -> None:
+        self.remove(session_id)
+        with self._lock:
+            self._local.pop(session_id, None)
+
+
+class SQLiteSessionBackend(StoreBackend):
+    """Sessions in a SQLite file, shared by all workers on a host and kept across restarts"""
+
+    def __init__(self, model_class: Type, path: str = './.fasttea/sessions.db', **kwargs):
+        super().__init__(model_class, **kwargs)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions '
+                         '(id TEXT PRIMARY KEY, version TEXT, data BLOB, last_access REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)')
+        self._db_lock = threading.Lock()
+        self._writes = 0
+
+    def read(self, session_id: str) -> Optional[tuple[str, bytes]]:
+        with self._db_lock:
+            row = self._db.execute('SELECT version, data, last_access FROM sessions WHERE id = ?',
+                                   (session_id,)).fetchone()
+        if row is None or (self.idle_timeout is not None and time.time() - row[2] > self.idle_timeout):
+            return None
+        return row[0], row[1]
+
+    def write(self, session_id: str, version: str, data: bytes, expected: Optional[str]) -> bool:
+        now = time.time()
+        with self._db_lock:
+            if expected is not None:
+                written = self._db.execute('UPDATE sessions SET version = ?, data = ?, last_access = ? '
+                                           'WHERE id = ? AND version = ?',
+                                           (version, data, now, session_id, expected)).rowcount == 1
+            else:
+                written = False
+            if not written:
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    if self.idle_timeout is not None:
+                        self._db.execute('DELETE FROM sessions WHERE id = ? AND last_access < ?',
+                                         (session_id, now - self.idle_timeout))
+                    # a session removed meanwhile (or a new one) is inserted, a newer version is kept
+                    written = self._db.execute('INSERT OR IGNORE INTO sessions (id, version, data, last_access) '
+                                               'VALUES (?, ?, ?, ?)', (session_id, version, data, now)).rowcount == 1
+                finally:
+                    self._db.execute('COMMIT')
+            self._writes += 1
+            if self.idle_timeout is not None and self._writes % 1000 == 0:
+                self._db.execute('DELETE FROM sessions WHERE last_access < ?', (now - self.idle_timeout,))
+        return written
+
+    def remove(self, session_id: str) -> None:
+        with self._db_lock:
+            self._db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+
+# slot: key (sha1 of the session id), version, last access, length of the data, data
+_SLOT_HEADER = struct.Struct('20s32sdI')
+
+
+class SharedMemorySessionBackend(StoreBackend):
+    """Sessions in a named shared memory block, shared by the workers of one host
+
+    The block is a hash table of fixed size slots, a full table evicts the least recently used
+    session of the probed slots. Writers are serialized with an flock on a lock file (POSIX only).
+    The block outlives worker restarts until the host reboots.
+    """
+
+    def __init__(self, model_class: Type, name: str = 'fasttea-sessions', slots: int = 4096,
+                 slot_size: int = 16 * 1024, probes: int = 16, **kwargs):
+        from multiprocessing import shared_memory
+        super().__init__(model_class, **kwargs)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probes = min(probes, slots)
+        size = slots * slot_size
+        try:
+            self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._memory = shared_memory.SharedMemory(name=name)
+        if self._memory.size < size:
+            raise ValueError(f"Shared memory {name} has {self._memory.size} bytes, {size} are needed")
+        _untrack(self._memory)
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+b')
+
+    @contextmanager
+    def _locked(self):
+        import fcntl
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _slot_indexes(self, key: bytes):
+        start = int.from_bytes(key[:8], 'little') % self.slots
+        return [(start + i) % self.slots for i in range(self.probes)]
+
+    def _header(self, index: int) -> tuple[bytes, bytes, float, int]:
+        return _SLOT_HEADER.unpack_from(self._memory.buf, index * self.slot_size)
+
+    def _find(self, key: bytes) -> Optional[int]:
+        for index in self._slot_indexes(key):
+            if self._header(index)[0] == key:
+                return index
+        return None
+
+    def read(self, session_id: str) -> Optional[tuple[str, bytes]]:
+        key = hashlib.sha1(session_id.encode()).digest()
+        with self._locked():
+            index = self._find(key)
+            if index is None:
+                return None
+            _, version, last_access, length = self._header(index)
+            if self.idle_timeout is not None and time.time() - last_access > self.idle_timeout:
+                return None
+            offset = index * self.slot_size + _SLOT_HEADER.size
+            return version.rstrip(b'\0').decode(), bytes(self._memory.buf[offset:offset + length])
+
+    def write(self, session_id: str, version: str, data: bytes, expected: Optional[str]) -> bool:
+        if len(data) > self.slot_size - _SLOT_HEADER.size:
+            raise ValueError(f"Session of {len(data)} bytes doesn't fit into a slot of {self.slot_size} bytes")
+        key = hashlib.sha1(session_id.encode()).digest()
+        with self._locked():
+            index = self._find(key)
+            if index is not None:
+                _, stored, last_access, _ = self._header(index)
+                live = self.idle_timeout is None or time.time() - last_access <= self.idle_timeout
+                if live and stored.rstrip(b'\0').decode() != expected:
+                    return False
+            else:
+                # a free slot, otherwise the least recently used one
+                index = min(self._slot_indexes(key), key=lambda i: self._header(i)[2])
+            offset = index * self.slot_size
+            _SLOT_HEADER.pack_into(self._memory.buf, offset, key, version.encode(), time.time(), len(data))
+            self._memory.buf[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + len(data)] = data
+        return True
+
+    def remove(self, session_id: str) -> None:
+        key = hashlib.sha1(session_id.encode()).digest()
+        with self._locked():
+            index = self._find(key)
+            if index is not None:
+                _SLOT_HEADER.pack_into(self._memory.buf, index * self.slot_size, b'', b'', 0.0, 0)
+
+
+def _untrack(memory):
+    """Keep the resource tracker from unlinking the block when this worker exits"""
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    except Exception:
+        pass
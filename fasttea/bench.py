@@ -0,0 +1,301 @@
+"""Benchmarks of the render and update hot paths
+
+    python -m fasttea.bench                       # render trees, hello and blackjack /update
+    python -m fasttea.bench --app cmd:app --messages change_name=Ada --output bench.json
+    python -m fasttea.bench --app blackjack:app --log history.json
+
+Render benchmarks time Element.to_htmx on generated trees of several depths and widths. Update
+benchmarks drive /init and /update of an app through an in-process ASGI client, first one client
+after the other for latencies, then concurrent clients for requests per second. Messages come from
+--messages or from an exported time travel log (see fasttea.history). Results are printed as JSON.
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple, Union
+from urllib.parse import urlencode
+
+from . import Element, FastTEA
+
+RENDER_SHAPES = [(2, 10), (4, 4), (6, 3), (3, 30)]
+APP_MESSAGES = {
+    'hello:app': [('greet', 'Ada'), ('greet', 'Grace')],
+    'blackjack:app': [('PlaceBet_10', None), ('Deal', None), ('Hit', None), ('Stand', None), ('Restart', None)],
+    'cmd:app': [('change_name', 'Ada'), ('set_time', '12:00:00')],
+}
+
+
+def build_tree(depth: int, width: int) -> Element:
+    """Tree of div elements with width children per level and text leaves"""
+    if depth <= 1:
+        return Element('span', {'class': 'leaf', 'data-depth': depth}, f'text {width} & more')
+    return Element('div', {'class': f'level-{depth}', 'hx-target': '#app'},
+                   [build_tree(depth - 1, width) for _ in range(width)])
+
+
+def _count(element: Element) -> int:
+    if isinstance(element.children, (list, tuple)):
+        return 1 + sum(_count(child) for child in element.children if isinstance(child, Element))
+    return 1
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Percentiles in microseconds of samples in seconds"""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1e6, 2)
+
+    return {
+        'n': len(ordered),
+        'mean_us': round(statistics.fmean(ordered) * 1e6, 2),
+        'p50_us': percentile(0.50),
+        'p90_us': percentile(0.90),
+        'p99_us': percentile(0.99),
+        'max_us': round(ordered[-1] * 1e6, 2),
+        'ops_per_sec': round(len(ordered) / sum(ordered), 1) if sum(ordered) else 0.0,
+    }
+
+
+def allocations(fn: Callable[[], Any], runs: int = 20) -> Dict[str, int]:
+    """Peak traced memory of one call and the bytes still allocated per call afterwards"""
+    fn()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        peak = 0
+        for _ in range(runs):
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak, 'retained_bytes_per_call': max(current - baseline, 0) // runs}
+
+
+def bench_render(shapes: List[Tuple[int, int]] = RENDER_SHAPES, iterations: int = 200) -> List[Dict[str, Any]]:
+    results = []
+    for depth, width in shapes:
+        tree = build_tree(depth, width)
+        html = tree.to_htmx()
+        for _ in range(min(iterations, 10)):
+            tree.to_htmx()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            tree.to_htmx()
+            samples.append(time.perf_counter() - started)
+        results.append({
+            'depth': depth,
+            'width': width,
+            'elements': _count(tree),
+            'html_bytes': len(html.encode()),
+            'latency': summarize(samples),
+            'memory': allocations(tree.to_htmx),
+        })
+    return results
+
+
+class ASGIClient:
+    """In-process HTTP client of an ASGI app which keeps its cookies, like one browser tab"""
+
+    def __init__(self, app: Callable):
+        self.app = app
+        self.cookies: Dict[str, str] = {}
+
+    async def request(self, method: str, path: str, headers: Union[Dict[str, str], None] = None,
+                      body: bytes = b'') -> Tuple[int, Dict[str, str], bytes]:
+        raw_headers = [(b'host', b'testserver'), (b'content-length', str(len(body)).encode())]
+        raw_headers += [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                        for key, value in (headers or {}).items()]
+        if self.cookies:
+            cookie = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+            raw_headers.append((b'cookie', cookie.encode('latin-1')))
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '', 'headers': raw_headers,
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        done = asyncio.Event()
+        request_sent = False
+        status = 0
+        response_headers: Dict[str, str] = {}
+        chunks: List[bytes] = []
+
+        async def receive() -> dict:
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message: dict):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                for key, value in message.get('headers', []):
+                    key, value = key.decode('latin-1').lower(), value.decode('latin-1')
+                    if key == 'set-cookie':
+                        name, _, rest = value.partition('=')
+                        self.cookies[name] = rest.split(';', 1)[0]
+                    response_headers[key] = value
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body'):
+                    done.set()
+
+        await self.app(scope, receive, send)
+        done.set()
+        return status, response_headers, b''.join(chunks)
+
+    async def update(self, action: str, value: Any = None) -> Tuple[int, Dict[str, str], bytes]:
+        form = {'action': action} if value is None else {'action': action, 'value': value}
+        return await self.request('POST', '/update', {
+            'content-type': 'application/x-www-form-urlencoded',
+            'hx-request': 'true',
+            'hx-target': 'app',
+        }, urlencode(form).encode())
+
+
+def load_app(spec: str) -> FastTEA:
+    """FastTEA instance of a module:attribute spec, the current directory is importable"""
+    module_name, _, attribute = spec.partition(':')
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def messages_from_log(path: str) -> List[Tuple[str, Any]]:
+    """Messages of an exported time travel log"""
+    with open(path) as file:
+        log = json.load(file)
+    return [(entry['msg']['action'], entry['msg'].get('value')) for entry in log['entries']]
+
+
+async def _client_session(app: FastTEA, messages: List[Tuple[str, Any]], requests: int,
+                          samples: Union[List[float], None]) -> int:
+    client = ASGIClient(app.app)
+    status, _, _ = await client.request('GET', '/init')
+    if status != 200:
+        raise RuntimeError(f'/init answered {status}')
+    response_bytes = 0
+    for i in range(requests):
+        action, value = messages[i % len(messages)]
+        started = time.perf_counter()
+        status, _, body = await client.update(action, value)
+        if samples is not None:
+            samples.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f'/update {action} answered {status}')
+        response_bytes += len(body)
+    return response_bytes
+
+
+async def _bench_update(app: FastTEA, messages: List[Tuple[str, Any]], requests: int, clients: int) -> Dict[str, Any]:
+    await _client_session(app, messages, min(requests, 20), None)
+    samples: List[float] = []
+    response_bytes = await _client_session(app, messages, requests, samples)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[_client_session(app, messages, requests // clients or 1, None) for _ in range(clients)])
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'mean_response_bytes': response_bytes // requests,
+        'latency': summarize(samples),
+        'concurrent_clients': clients,
+        'requests_per_sec': round(clients * (requests // clients or 1) / elapsed, 1),
+    }
+
+
+def bench_update(app: FastTEA, messages: List[Tuple[str, Any]], requests: int = 500, clients: int = 10) -> Dict[str, Any]:
+    result = asyncio.run(_bench_update(app, messages, requests, clients))
+    loop = asyncio.new_event_loop()
+    try:
+        client = ASGIClient(app.app)
+        loop.run_until_complete(client.request('GET', '/init'))
+        action, value = messages[0]
+        result['memory'] = allocations(lambda: loop.run_until_complete(client.update(action, value)), runs=10)
+    finally:
+        loop.close()
+    return result
+
+
+def run(apps: Dict[str, List[Tuple[str, Any]]], render: bool = True, iterations: int = 200,
+        requests: int = 500, clients: int = 10) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if render:
+        report['render'] = bench_render(iterations=iterations)
+    report['update'] = {}
+    for spec, messages in apps.items():
+        try:
+            app = load_app(spec)
+        except (ImportError, AttributeError) as e:
+            report['update'][spec] = {'error': repr(e)}
+            continue
+        report['update'][spec] = bench_update(app, messages, requests, clients)
+    return report
+
+
+def _parse_message(text: str) -> Tuple[str, Union[str, None]]:
+    action, separator, value = text.partition('=')
+    return action, value if separator else None
+
+
+def main(argv: Union[List[str], None] = None):
+    parser = argparse.ArgumentParser(prog='python -m fasttea.bench')
+    parser.add_argument('--app', action='append', help='module:attribute of a FastTEA app, repeatable')
+    parser.add_argument('--messages', nargs='+', help='action or action=value sent to every --app in turn')
+    parser.add_argument('--log', help='exported time travel log whose messages are sent to every --app')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=200, help='renders per tree shape')
+    parser.add_argument('--no-render', action='store_true')
+    parser.add_argument('--quick', action='store_true', help='few iterations, for a smoke test')
+    parser.add_argument('--output', help='file for the JSON report instead of stdout')
+    args = parser.parse_args(argv)
+
+    specs = args.app or ['hello:app', 'blackjack:app']
+    if args.log:
+        messages = messages_from_log(args.log)
+    elif args.messages:
+        messages = [_parse_message(text) for text in args.messages]
+    else:
+        messages = None
+    apps = {}
+    for spec in specs:
+        if messages is None and spec not in APP_MESSAGES:
+            parser.error(f'--messages or --log needed for {spec}')
+        apps[spec] = messages or APP_MESSAGES[spec]
+    if args.quick:
+        args.iterations, args.requests, args.clients = 20, 40, 4
+
+    report = run(apps, not args.no_render, args.iterations, args.requests, args.clients)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
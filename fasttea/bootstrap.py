@@ -3,10 +3,11 @@ from . import Element
 from .html import div, button as html_button
 
 def add_bootstrap_class(element: Element, bootstrap_class: str):
+    # a new dict, the attributes may be shared with other elements
     if 'class' in element.attributes:
-        element.attributes['class'] += f" {bootstrap_class}"
+        element.attributes = {**element.attributes, 'class': f"{element.attributes['class']} {bootstrap_class}"}
     else:
-        element.attributes['class'] = bootstrap_class
+        element.attributes = {**element.attributes, 'class': bootstrap_class}
     return element
 
 def container(attributes: Dict[str, Any],children: Union[List[Element], Element, str]) -> Element:
@@ -0,0 +1,127 @@
+"""Compression of the HTML fragments and other text responses of an app
+
+An ASGI middleware which negotiates brotli (if the brotli package is installed) or gzip with the
+Accept-Encoding of the request. Bodies below minimum_size go out as they are, streamed bodies are
+compressed chunk by chunk and flushed after every chunk, so the client sees each one as it arrives.
+"""
+import zlib
+from typing import Callable, Dict, Union
+
+from .http_cache import choose_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/javascript', 'text/css', 'text/plain', 'application/json',
+                      'image/svg+xml')
+AVAILABLE_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class Compressor:
+    """Streaming compressor of one response body"""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.process(data) + (self._brotli.flush() if flush else b'')
+        return self._zlib.compress(data) + (self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else b'')
+
+    def finish(self, data: bytes = b'') -> bytes:
+        if self.encoding == 'br':
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: Callable, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accept_encoding = None
+        for key, value in scope['headers']:
+            if key == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+        encoding = choose_encoding(accept_encoding, AVAILABLE_ENCODINGS)
+        if encoding == 'identity':
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, _CompressingSend(send, encoding, self))
+
+
+class _CompressingSend:
+    """send of one response, the start message waits for the first body chunk"""
+
+    def __init__(self, send: Callable, encoding: str, middleware: CompressionMiddleware):
+        self.send = send
+        self.encoding = encoding
+        self.middleware = middleware
+        self.start: Union[dict, None] = None
+        self.compressor: Union[Compressor, None] = None
+        self.passthrough = False
+
+    async def __call__(self, message: dict):
+        if message['type'] == 'http.response.start':
+            self.start = message
+            headers = _headers(message)
+            content_type = headers.get('content-type', '')
+            length = headers.get('content-length')
+            self.passthrough = (message['status'] not in (200, 201, 203)
+                                or 'content-encoding' in headers
+                                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                                or (length is not None and int(length) < self.middleware.minimum_size))
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            return await self.send(message)
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.compressor is None:
+            if not more_body and len(body) < self.middleware.minimum_size:
+                # a small body in one piece, which had no content length
+                self.passthrough = True
+                await self.send(self.start)
+                return await self.send(message)
+            self.compressor = Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            headers = [(key, value) for key, value in self.start['headers']
+                       if key.lower() not in (b'content-length', b'etag')]
+            etag = _headers(self.start).get('etag')
+            if etag:
+                # the compressed body is another representation, the same weak etag still validates
+                headers.append((b'etag', ('W/' + etag.removeprefix('W/')).encode('latin-1')))
+            headers.append((b'content-encoding', self.encoding.encode()))
+            vary = _headers(self.start).get('vary')
+            if vary is None:
+                headers.append((b'vary', b'Accept-Encoding'))
+            elif 'accept-encoding' not in vary.lower():
+                headers = [(key, value + b', Accept-Encoding' if key.lower() == b'vary' else value)
+                           for key, value in headers]
+            if not more_body:
+                data = self.compressor.finish(body)
+                headers.append((b'content-length', str(len(data)).encode()))
+                await self.send({**self.start, 'headers': headers})
+                return await self.send({'type': 'http.response.body', 'body': data})
+            await self.send({**self.start, 'headers': headers})
+        if more_body:
+            data = self.compressor.compress(body, flush=True)
+        else:
+            data = self.compressor.finish(body)
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+
+def _headers(message: dict) -> Dict[str, str]:
+    return {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in message.get('headers', [])}
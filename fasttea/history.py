@@ -0,0 +1,133 @@
+"""Time-travel log of the messages of a session
+
+Every message is recorded with the model it was applied to, the resulting cmd and the time spent
+in update, view and render. The log is a bounded ring buffer, the oldest entries are dropped.
+An exported log can be replayed offline against the update function:
+
+    app = FastTEA(AppModel(), history=500)
+    ...
+    log = app.export_history(session_id)   # or GET /_fasttea/history
+    result = replay(log, update, AppModel)
+    result.model, result.diverged
+"""
+import asyncio
+import inspect
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Type, Union
+
+from .session import copy_model
+from .snapshot import Snapshotter
+
+
+class HistoryEntry:
+    """One message of a session, timings are in milliseconds"""
+
+    def __init__(self, index: int, msg: Any, model: Any):
+        self.index = index
+        self.time = time.time()
+        self.msg = msg
+        # model the message was applied to
+        self.model = model
+        self.cmd: Any = None
+        self.update_ms = 0.0
+        # view and render run once per request, their timings belong to its last message
+        self.view_ms: Union[float, None] = None
+        self.render_ms: Union[float, None] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "time": self.time,
+            "msg": self.msg.model_dump(mode="json"),
+            "model": self.model.model_dump(mode="json"),
+            "cmd": self.cmd.model_dump(mode="json") if self.cmd is not None else None,
+            "update_ms": self.update_ms,
+            "view_ms": self.view_ms,
+            "render_ms": self.render_ms,
+        }
+
+
+class MessageLog:
+    """Ring buffer of the last maxsize messages of a session"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: Deque[HistoryEntry] = deque(maxlen=maxsize)
+        self.count = 0
+
+    def record(self, msg: Any, model: Any) -> HistoryEntry:
+        """Entry for a message before it is applied to model"""
+        # a model changed in place by update must not change the logged one
+        if not getattr(type(model), 'model_config', {}).get('frozen'):
+            model = copy_model(model)
+        entry = HistoryEntry(self.count, msg, model)
+        self.count += 1
+        self.entries.append(entry)
+        return entry
+
+    def discard(self, count: int):
+        """Forget the last count entries, their messages weren't applied"""
+        for _ in range(min(count, len(self.entries))):
+            self.entries.pop()
+            self.count -= 1
+
+    @property
+    def dropped(self) -> int:
+        return self.count - len(self.entries)
+
+    def export(self, model: Any = None) -> Dict[str, Any]:
+        """The log as JSON data, model is the current model which follows the last entry"""
+        return {
+            "dropped": self.dropped,
+            "entries": [entry.to_dict() for entry in self.entries],
+            "model": model.model_dump(mode="json") if model is not None else None,
+        }
+
+
+class ReplayResult:
+    def __init__(self, model: Any, cmds: List[Any], diverged: List[int]):
+        # model after the last message
+        self.model = model
+        self.cmds = cmds
+        # indexes of the entries whose model or cmd differs from the log
+        self.diverged = diverged
+
+
+def replay(log: Union[Dict[str, Any], str], update_fn: Callable, model_class: Type,
+           resync: bool = False) -> ReplayResult:
+    """Apply the logged messages to the model of the first entry with update_fn
+
+    Every resulting model is compared with the logged model of the next entry (and the current model
+    of the export after the last one), every cmd with the logged cmd. A pure update function
+    replays without divergence, with resync the replay continues from the logged model after one.
+    """
+    from . import Msg, Cmd
+
+    if isinstance(log, str):
+        log = json.loads(log)
+    entries = log["entries"]
+    if not entries:
+        return ReplayResult(None, [], [])
+    snapshots = Snapshotter(model_class)
+    expected_models = [entry["model"] for entry in entries[1:]] + [log.get("model")]
+
+    async def run() -> ReplayResult:
+        model = snapshots.build(entries[0]["model"])
+        cmds, diverged = [], []
+        for entry, expected_model in zip(entries, expected_models):
+            result = update_fn(Msg(**entry["msg"]), model)
+            if inspect.isawaitable(result):
+                result = await result
+            model, cmd = result
+            cmds.append(cmd)
+            dumped_cmd = cmd.model_dump(mode="json") if isinstance(cmd, Cmd) else None
+            if dumped_cmd != entry["cmd"] or (expected_model is not None
+                                              and model.model_dump(mode="json") != expected_model):
+                diverged.append(entry["index"])
+                if resync and expected_model is not None:
+                    model = snapshots.build(expected_model)
+        return ReplayResult(model, cmds, diverged)
+
+    return asyncio.run(run())
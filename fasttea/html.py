@@ -1,9 +1,27 @@
-from typing import List, Dict, Any, Union
-from . import Element
+from typing import List, Dict, Any, Union, Callable
+from . import Element, Markup, Lazy, RowSource, virtual_element
+from .template import template
 
 def text(content: str) -> str:
     return content
 
+def raw(content: str) -> Markup:
+    """Trusted HTML which is not escaped"""
+    return Markup(content)
+
+def lazy(fn: Callable[..., Element], *args) -> Lazy:
+    """Like Elm's Html.Lazy, the HTML of fn(*args) is reused while args are equal to the last render"""
+    return Lazy(fn, args)
+
+def virtual_table(source: RowSource, model: Any, attributes: Dict[str, Any] = {},
+                  header: Union[List[Element], Element, None] = None) -> Element:
+    """Table of the rows of source which renders only the visible window, see FastTEA.virtual_rows"""
+    return virtual_element(source, model, attributes, header, True)
+
+def virtual_list(source: RowSource, model: Any, attributes: Dict[str, Any] = {}) -> Element:
+    """Like virtual_table with a div per row"""
+    return virtual_element(source, model, attributes, None, False)
+
 def div(attributes: Dict[str, Any], children: Union[List[Element], Element, str]) -> Element:
     return Element("div", attributes, children)
 
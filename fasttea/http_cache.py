@@ -0,0 +1,46 @@
+import hashlib
+from typing import Union
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_hash(data: bytes) -> str:
+    """Short hash for content addressed asset names"""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def strong_etag(data: bytes) -> str:
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Union[str, None], etag: str) -> bool:
+    """True if the If-None-Match header of a conditional request names the etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+def choose_encoding(accept_encoding: Union[str, None], available) -> str:
+    """Best of the available content codings ('br', 'gzip') the client accepts, 'identity' if none"""
+    if not accept_encoding:
+        return 'identity'
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    for coding in ('br', 'gzip'):
+        if coding in available and weights.get(coding, weights.get('*', 0.0)) > 0:
+            return coding
+    return 'identity'
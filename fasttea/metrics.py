@@ -0,0 +1,112 @@
+"""Instrumentation hooks around the phases of a request and a Prometheus style metrics collector
+
+Phases are 'parse' (form data and messages), 'update' (one per message), 'view', 'render' and
+'request' (the whole request or WebSocket message). An app without instruments only checks an
+empty list per phase.
+
+    class SlowUpdates(Instrument):
+        def after(self, phase, session_id, action, seconds):
+            if phase == 'update' and seconds > 0.1:
+                print(f"{action} took {seconds:.3f}s")
+
+    app = FastTEA(AppModel(), metrics=True, instruments=[SlowUpdates()])   # GET /_fasttea/metrics
+"""
+import bisect
+import threading
+from typing import Dict, List, Tuple, Union
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Instrument:
+    """Base class of instrumentation hooks, subclasses override the hooks they need"""
+
+    def before(self, phase: str, session_id: str, action: Union[str, None]) -> None:
+        pass
+
+    def after(self, phase: str, session_id: str, action: Union[str, None], seconds: float) -> None:
+        pass
+
+    def response(self, path: str, size: int) -> None:
+        pass
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def exposition(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum!r}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics(Instrument):
+    """Histograms of phase timings and response sizes and counters of messages per action
+
+    Every worker process collects its own metrics. Actions come from clients, so only the first
+    max_actions distinct actions get a label of their own, all others are counted as 'other'.
+    """
+
+    def __init__(self, max_actions: int = 200):
+        self.max_actions = max_actions
+        self.phases: Dict[str, Histogram] = {}
+        self.responses: Dict[str, Histogram] = {}
+        self.actions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def after(self, phase: str, session_id: str, action: Union[str, None], seconds: float) -> None:
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram(SECONDS_BUCKETS)
+            histogram.observe(seconds)
+            if phase == 'update':
+                action = str(action)
+                if action not in self.actions and len(self.actions) >= self.max_actions:
+                    action = 'other'
+                self.actions[action] = self.actions.get(action, 0) + 1
+
+    def response(self, path: str, size: int) -> None:
+        with self._lock:
+            histogram = self.responses.get(path)
+            if histogram is None:
+                histogram = self.responses[path] = Histogram(BYTES_BUCKETS)
+            histogram.observe(size)
+
+    def exposition(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = ['# HELP fasttea_phase_seconds Time spent in each phase of handling messages',
+                     '# TYPE fasttea_phase_seconds histogram']
+            for phase, histogram in self.phases.items():
+                lines += histogram.exposition('fasttea_phase_seconds', f'phase="{_label(phase)}"')
+            lines += ['# HELP fasttea_response_bytes Size of the HTML sent to clients',
+                      '# TYPE fasttea_response_bytes histogram']
+            for path, histogram in self.responses.items():
+                lines += histogram.exposition('fasttea_response_bytes', f'path="{_label(path)}"')
+            lines += ['# HELP fasttea_messages_total Messages applied by update, per action',
+                      '# TYPE fasttea_messages_total counter']
+            lines += [f'fasttea_messages_total{{action="{_label(action)}"}} {count}'
+                      for action, count in self.actions.items()]
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
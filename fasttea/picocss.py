@@ -3,17 +3,20 @@ from . import Element
 from .html import div, input_
 
 def add_pico_class(element: Element, pico_class: str, more_attributes:Dict[str,str] | None = None):
+    # a new dict, the attributes may be shared with other elements
+    attributes = dict(element.attributes)
     if len(pico_class)>0:
-        if 'class' in element.attributes:
-            element.attributes['class'] += f" {pico_class}"
+        if 'class' in attributes:
+            attributes['class'] += f" {pico_class}"
         else:
-            element.attributes['class'] = pico_class
+            attributes['class'] = pico_class
 
     if more_attributes:
         for key, value in more_attributes.items():
-            if key not in element.attributes:
-                element.attributes[key] = value
+            if key not in attributes:
+                attributes[key] = value
 
+    element.attributes = attributes
     return element
 
 def container(attributes: Dict[str, Any],children: Union[List[Element], Element, str]) -> Element:
@@ -0,0 +1,114 @@
+import asyncio
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+SESSION_COOKIE = 'fasttea_session'
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def copy_model(model: Any) -> Any:
+    """Deep copy of a pydantic model, so every session starts from its own initial model"""
+    if hasattr(model, 'model_copy'):
+        return model.model_copy(deep=True)
+    return model.copy(deep=True)
+
+
+class Session:
+    """State of one client: the model plus process local data of the runtime"""
+
+    def __init__(self, session_id: str, model: Any):
+        self.id = session_id
+        self.model = model
+        self.last_access = time.monotonic()
+        # version of the stored model, used by backends shared between processes
+        self.version: Any = None
+        # last view tree sent to the client, None if the client DOM is unknown
+        self.view: Any = None
+        # stamp of the last render, see FastTEA._render
+        self.rendered = 0
+        self.lazy_cache: Any = None
+        # push channels (WebSocket, server sent events) of the connected clients
+        self.connections: list = []
+        self.subscriptions: Any = None
+        # message log of FastTEA(history=...), see fasttea.history
+        self.history: Any = None
+        # scroll positions (first visible row) of virtual tables and lists by name
+        self.virtual_starts: dict = {}
+        # keeps the messages of the session in order
+        self.lock = asyncio.Lock()
+
+
+class SessionConflictError(Exception):
+    """Messages couldn't be applied because other workers kept changing the session"""
+
+
+class SessionBackend:
+    """Interface for session stores, subclass it to keep models outside the process"""
+
+    def load(self, session_id: str) -> Optional[Session]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def save(self, session: Session) -> Optional[bool]:
+        """Store the session, False if another worker stored it since it was loaded (nothing is written then)"""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class MemorySessionBackend(SessionBackend):
+    """Bounded in-memory LRU of sessions with idle timeout eviction"""
+
+    def __init__(self, max_sessions: int = 10000, idle_timeout: float | None = 3600.0):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[Session]:
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._is_idle(session, now):
+                del self._sessions[session_id]
+                return None
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def save(self, session: Session) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            session.last_access = now
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            self._evict(now)
+        return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _is_idle(self, session: Session, now: float) -> bool:
+        return self.idle_timeout is not None and now - session.last_access > self.idle_timeout
+
+    def _evict(self, now: float) -> None:
+        # the dict is kept in access order, so idle sessions are always at the front
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if not self._is_idle(oldest, now):
+                break
+            self._sessions.popitem(last=False)
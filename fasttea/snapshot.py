@@ -0,0 +1,221 @@
+"""Compact, versioned binary snapshots of models
+
+Models are encoded by their pydantic fields: a model becomes the list of its field values in
+declaration order (nested models too), so field names are not repeated in every snapshot.
+The list is packed with msgpack if it is installed, otherwise as compact JSON, and compressed
+with zstd (if zstandard is installed and selected) or zlib.
+
+    snapshots = Snapshotter(BlackjackModel, version=2)
+
+    @snapshots.migration(1, fields=['deck', 'player_hand', 'dealer_hand', 'balance'])
+    def add_bet(data: dict) -> dict:
+        data['bet'] = 0
+        return data
+
+    data = snapshots.dumps(model)
+    model = snapshots.loads(data)
+"""
+import json
+import struct
+import types
+import typing
+import zlib
+from enum import Enum
+from typing import Any, Callable, Dict, List, Type, Union
+
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'FT'
+FORMAT = 1
+# magic, format, codec, compression, model version, schema fingerprint
+_HEADER = struct.Struct('!2sBBBII')
+
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+_COMPRESSIONS = {'none': COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'zstd': COMPRESSION_ZSTD}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def fingerprint(model_class: Type[BaseModel]) -> int:
+    """Checksum of the field layout of a model class and its nested models"""
+    seen = set()
+
+    def layout(cls) -> str:
+        if cls in seen:
+            return cls.__name__
+        seen.add(cls)
+        parts = []
+        for name, field in cls.model_fields.items():
+            nested = [layout(model) for model in _models_in(field.annotation)]
+            parts.append(name + ('(' + ','.join(nested) + ')' if nested else ''))
+        return ';'.join(parts)
+
+    return zlib.crc32(layout(model_class).encode())
+
+
+def _models_in(annotation) -> List[Type[BaseModel]]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return [annotation]
+    return [model for arg in typing.get_args(annotation) for model in _models_in(arg)]
+
+
+def encode_value(value: Any) -> Any:
+    """Plain data of a value, models become lists of their field values"""
+    if isinstance(value, BaseModel):
+        return [encode_value(getattr(value, name)) for name in type(value).model_fields]
+    if isinstance(value, Enum):
+        return encode_value(value.value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool, bytes)):
+        return value
+    from pydantic_core import to_jsonable_python
+    return to_jsonable_python(value)
+
+
+def decode_value(annotation, data: Any) -> Any:
+    """Inverse of encode_value, guided by the type annotation; pydantic validates the result"""
+    if data is None:
+        return None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        if not isinstance(data, list):
+            return data
+        return {name: decode_value(field.annotation, item)
+                for (name, field), item in zip(annotation.model_fields.items(), data)}
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin in (list, set, frozenset) and args and isinstance(data, list):
+        return [decode_value(args[0], item) for item in data]
+    if origin is tuple and args and isinstance(data, list):
+        if len(args) == 2 and args[1] is Ellipsis:
+            return [decode_value(args[0], item) for item in data]
+        return [decode_value(arg, item) for arg, item in zip(args, data)]
+    if origin is dict and len(args) == 2 and isinstance(data, dict):
+        return {key: decode_value(args[1], item) for key, item in data.items()}
+    if origin in (Union, types.UnionType):
+        # Optional[X] is decoded as X, other unions are left to pydantic
+        options = [arg for arg in args if arg is not type(None)]
+        if len(options) == 1:
+            return decode_value(options[0], data)
+    return data
+
+
+class Snapshotter:
+    """Serializes models of one class into versioned snapshots"""
+
+    def __init__(self, model_class: Type[BaseModel], version: int = 1, compression: str = 'zlib',
+                 level: Union[int, None] = None, min_compress_size: int = 256):
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        self.model_class = model_class
+        self.version = version
+        self.compression = compression
+        self.level = level
+        self.min_compress_size = min_compress_size
+        self.fingerprint = fingerprint(model_class)
+        self._adapters = {name: TypeAdapter(field.annotation) for name, field in model_class.model_fields.items()}
+        self._migrations: Dict[int, tuple[List[str], Callable[[Dict[str, Any]], Dict[str, Any]]]] = {}
+
+    def migration(self, from_version: int, fields: List[str]):
+        """Decorator for a function which turns the field dict of from_version into one of the next version
+
+        fields are the names of the model fields in from_version, in declaration order.
+        """
+        def decorator(f: Callable[[Dict[str, Any]], Dict[str, Any]]):
+            self._migrations[from_version] = (fields, f)
+            return f
+
+        return decorator
+
+    def dumps(self, model: BaseModel) -> bytes:
+        values = encode_value(model)
+        if msgpack is not None:
+            codec, payload = CODEC_MSGPACK, msgpack.packb(values, use_bin_type=True)
+        else:
+            codec, payload = CODEC_JSON, json.dumps(values, separators=(',', ':')).encode('utf-8')
+        compression = COMPRESSION_NONE
+        if len(payload) >= self.min_compress_size and self.compression != 'none':
+            compression = _COMPRESSIONS[self.compression]
+            payload = self._compress(compression, payload)
+        return _HEADER.pack(MAGIC, FORMAT, codec, compression, self.version, self.fingerprint) + payload
+
+    def loads(self, data: bytes) -> BaseModel:
+        if len(data) < _HEADER.size:
+            raise SnapshotError("Snapshot is too short")
+        magic, format, codec, compression, version, stored_fingerprint = _HEADER.unpack_from(data)
+        if magic != MAGIC or format != FORMAT:
+            raise SnapshotError("Not a fastTEA snapshot")
+        try:
+            return self._load(codec, compression, version, stored_fingerprint, data[_HEADER.size:])
+        except SnapshotError:
+            raise
+        except Exception as e:
+            # corrupt data fails anywhere in decompression, decoding or validation
+            raise SnapshotError(f"Snapshot can't be read: {e!r}") from e
+
+    def _load(self, codec: int, compression: int, version: int, stored_fingerprint: int, data: bytes) -> BaseModel:
+        payload = self._decompress(compression, data)
+        if codec == CODEC_MSGPACK:
+            if msgpack is None:
+                raise SnapshotError("Snapshot was written with msgpack, which is not installed")
+            values = msgpack.unpackb(payload, raw=False)
+        else:
+            values = json.loads(payload)
+
+        if version == self.version and stored_fingerprint == self.fingerprint:
+            return self.build(decode_value(self.model_class, values))
+        if version == self.version:
+            raise SnapshotError(f"Fields of {self.model_class.__name__} changed without a new snapshot version")
+        if version not in self._migrations:
+            raise SnapshotError(f"No migration from version {version} of {self.model_class.__name__}")
+        fields, _ = self._migrations[version]
+        # nested models of old snapshots are read with the current classes
+        annotations = {name: field.annotation for name, field in self.model_class.model_fields.items()}
+        fields_data = {name: decode_value(annotations.get(name), value) for name, value in zip(fields, values)}
+        while version < self.version:
+            if version not in self._migrations:
+                raise SnapshotError(f"No migration from version {version} of {self.model_class.__name__}")
+            fields_data = self._migrations[version][1](fields_data)
+            version += 1
+        return self.build(fields_data)
+
+    def build(self, fields_data: Dict[str, Any]) -> BaseModel:
+        """Model of the field values, each validated against its annotation"""
+        # fields are validated one by one, model_validate would run a custom __init__ of the model again
+        return self.model_class.model_construct(**{name: self._adapters[name].validate_python(value)
+                                                   for name, value in fields_data.items() if name in self._adapters})
+
+    def _compress(self, compression: int, payload: bytes) -> bytes:
+        if compression == COMPRESSION_ZSTD:
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(payload)
+        return zlib.compress(payload, self.level if self.level is not None else 6)
+
+    @staticmethod
+    def _decompress(compression: int, payload: bytes) -> bytes:
+        if compression == COMPRESSION_NONE:
+            return payload
+        if compression == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise SnapshotError("Snapshot was compressed with zstd, which is not installed")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        return zlib.decompress(payload)
@@ -0,0 +1,214 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Union, Iterator
+
+from fastapi.responses import Response, StreamingResponse
+
+from .http_cache import etag_matches, choose_encoding
+
+_ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+_CHUNK_SIZE = 64 * 1024
+
+
+class StaticFile:
+    """Stat data and hash of one file, together with its precompressed siblings"""
+
+    def __init__(self, path: str):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.etag = '"' + _file_hash(path) + '"'
+        self.media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.variants: Dict[str, str] = {encoding: path + suffix for encoding, suffix in _ENCODING_SUFFIXES.items()
+                                         if os.path.isfile(path + suffix)}
+
+    def is_stale(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return stat.st_size != self.size or int(stat.st_mtime) != self.mtime
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def _parse_range(header: str, size: int) -> Union[tuple[int, int], None, bool]:
+    """(start, end) of a single byte range, None to ignore the header, False if it can't be satisfied"""
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        # multipart ranges are answered with the whole file
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            length = int(last)
+            if length == 0:
+                return False
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return False
+    return start, min(end, size - 1)
+
+
+class StaticFiles:
+    """Static files of an app, indexed once at startup
+
+    Answers conditional requests with 304, serves single byte ranges and picks .br/.gz siblings
+    by Accept-Encoding. Small files are kept in a bounded in-memory LRU.
+    """
+
+    def __init__(self, directory: str = './static', mount_path: str = '/static',
+                 cache_control: str = 'public, max-age=3600',
+                 memory_cache_bytes: int = 8 * 1024 * 1024,
+                 memory_file_limit: int = 256 * 1024):
+        self.directory = os.path.realpath(directory)
+        self.mount_path = mount_path.rstrip('/')
+        self.cache_control = cache_control
+        self.memory_cache_bytes = memory_cache_bytes
+        self.memory_file_limit = memory_file_limit
+        self._index: Dict[str, StaticFile] = {}
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self.build_index()
+
+    def build_index(self):
+        index = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(tuple(_ENCODING_SUFFIXES.values())):
+                    continue
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                index[key] = StaticFile(path)
+        self._index = index
+
+    def lookup(self, file_path: str) -> Union[StaticFile, None]:
+        static_file = self._index.get(file_path)
+        if static_file is not None and not static_file.is_stale():
+            return static_file
+        # files changed or added after startup, never outside of the directory
+        full_path = os.path.realpath(os.path.join(self.directory, file_path))
+        if '\0' in file_path or not full_path.startswith(self.directory + os.sep) or not os.path.isfile(full_path):
+            self._index.pop(file_path, None)
+            return None
+        key = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+        static_file = self._index[key] = StaticFile(full_path)
+        with self._lock:
+            self._forget(full_path)
+        return static_file
+
+    def response(self, static_file: StaticFile, headers) -> Response:
+        """Response for a GET of the file with the given request headers"""
+        response_headers = {
+            'ETag': static_file.etag,
+            'Last-Modified': static_file.last_modified,
+            'Cache-Control': self.cache_control,
+            'Accept-Ranges': 'bytes',
+        }
+        if static_file.variants:
+            response_headers['Vary'] = 'Accept-Encoding'
+        if self._not_modified(static_file, headers):
+            return Response(status_code=304, headers=response_headers)
+
+        range_header = headers.get('range')
+        if range_header and self._if_range_matches(static_file, headers.get('if-range')):
+            byte_range = _parse_range(range_header, static_file.size)
+            if byte_range is False:
+                response_headers['Content-Range'] = f'bytes */{static_file.size}'
+                return Response(status_code=416, headers=response_headers)
+            if byte_range is not None:
+                start, end = byte_range
+                response_headers['Content-Range'] = f'bytes {start}-{end}/{static_file.size}'
+                return self._body(static_file.path, static_file.size, start, end - start + 1, 206,
+                                  static_file.media_type, response_headers)
+
+        encoding = choose_encoding(headers.get('accept-encoding'), static_file.variants)
+        path = static_file.path
+        if encoding != 'identity':
+            path = static_file.variants[encoding]
+            response_headers['Content-Encoding'] = encoding
+        size = os.path.getsize(path)
+        return self._body(path, size, 0, size, 200, static_file.media_type, response_headers)
+
+    @staticmethod
+    def _not_modified(static_file: StaticFile, headers) -> bool:
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            return etag_matches(if_none_match, static_file.etag)
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return static_file.mtime <= int(parsedate_to_datetime(if_modified_since).timestamp())
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(static_file: StaticFile, if_range: Union[str, None]) -> bool:
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == static_file.etag
+        return if_range == static_file.last_modified
+
+    def _body(self, path: str, size: int, start: int, length: int, status_code: int, media_type: str,
+              headers: Dict[str, str]) -> Response:
+        headers['Content-Length'] = str(length)
+        if size <= self.memory_file_limit:
+            data = self._cached(path)
+            return Response(data[start:start + length], status_code=status_code, media_type=media_type,
+                            headers=headers)
+        return StreamingResponse(_read_chunks(path, start, length), status_code=status_code,
+                                 media_type=media_type, headers=headers)
+
+    def _cached(self, path: str) -> bytes:
+        with self._lock:
+            data = self._memory.get(path)
+            if data is not None:
+                self._memory.move_to_end(path)
+                return data
+        with open(path, 'rb') as file:
+            data = file.read()
+        with self._lock:
+            self._forget(path)
+            self._memory[path] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_cache_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+        return data
+
+    def _forget(self, path: str):
+        for cached_path in [path] + [path + suffix for suffix in _ENCODING_SUFFIXES.values()]:
+            data = self._memory.pop(cached_path, None)
+            if data is not None:
+                self._memory_size -= len(data)
+
+
+def _read_chunks(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Set
+
+from rich import print
+
+Dispatch = Callable[[str, Any], Awaitable[None]]
+
+
+class Sub:
+    """Base class for subscriptions, like Sub in Elm
+
+    The key identifies a subscription across model changes, a running subscription whose key is
+    still returned by the subscription function is kept, all others are started or cancelled.
+    """
+    key: Hashable = None
+
+    async def run(self, dispatch: Dispatch):
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class Every(Sub):
+    """Message with the current time every interval seconds"""
+
+    def __init__(self, seconds: float, action: str):
+        self.seconds = seconds
+        self.action = action
+        self.key = ('every', seconds, action)
+
+    async def run(self, dispatch: Dispatch):
+        while True:
+            await asyncio.sleep(self.seconds)
+            await dispatch(self.action, time.time())
+
+
+class FromQueue(Sub):
+    """Message for every item of an asyncio queue, each item is delivered to one session only"""
+
+    def __init__(self, queue: asyncio.Queue, action: str):
+        self.queue = queue
+        self.action = action
+        self.key = ('queue', id(queue), action)
+
+    async def run(self, dispatch: Dispatch):
+        while True:
+            await dispatch(self.action, await self.queue.get())
+
+
+class FromIterator(Sub):
+    """Message for every item of the async iterator created by factory"""
+
+    def __init__(self, factory: Callable[[], AsyncIterator[Any]], action: str, key: Hashable = None):
+        self.factory = factory
+        self.action = action
+        self.key = ('iterator', key if key is not None else factory, action)
+
+    async def run(self, dispatch: Dispatch):
+        async for value in self.factory():
+            await dispatch(self.action, value)
+
+
+class Topic:
+    """Broadcast of external events, every subscribed session gets every published value"""
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self._queues: Set[asyncio.Queue] = set()
+
+    def publish(self, value: Any):
+        for queue in self._queues:
+            if queue.full():
+                # a slow subscriber loses the oldest value instead of blocking the publisher
+                queue.get_nowait()
+            queue.put_nowait(value)
+
+    def listen(self, action: str) -> Sub:
+        return _TopicSub(self, action)
+
+
+class _TopicSub(Sub):
+    def __init__(self, topic: Topic, action: str):
+        self.topic = topic
+        self.action = action
+        self.key = ('topic', id(topic), action)
+
+    async def run(self, dispatch: Dispatch):
+        queue = asyncio.Queue(self.topic.maxsize)
+        self.topic._queues.add(queue)
+        try:
+            while True:
+                await dispatch(self.action, await queue.get())
+        finally:
+            self.topic._queues.discard(queue)
+
+
+class SubscriptionRunner:
+    """One task per active subscription of a session"""
+
+    def __init__(self, dispatch: Dispatch):
+        self.dispatch = dispatch
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # tasks which removed their own subscription while dispatching, they end once the dispatch is done
+        self._retired: Set[asyncio.Task] = set()
+
+    def update(self, subs: List[Sub]):
+        wanted = {sub.key: sub for sub in subs}
+        for key in list(self._tasks):
+            if key not in wanted:
+                self._cancel(self._tasks.pop(key))
+        for key, sub in wanted.items():
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._run(sub))
+
+    def stop(self):
+        for task in self._tasks.values():
+            self._cancel(task)
+        self._tasks.clear()
+
+    def _cancel(self, task: asyncio.Task):
+        # update and stop run within the dispatch of a subscription, which must not be cut short
+        if task is asyncio.current_task():
+            self._retired.add(task)
+        else:
+            task.cancel()
+
+    async def _dispatch(self, action: str, value: Any):
+        await self.dispatch(action, value)
+        task = asyncio.current_task()
+        if task in self._retired:
+            self._retired.discard(task)
+            raise asyncio.CancelledError()
+
+    async def _run(self, sub: Sub):
+        try:
+            await sub.run(self._dispatch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Subscription {sub.key} failed: {e}")
+        finally:
+            self._retired.discard(asyncio.current_task())
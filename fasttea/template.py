@@ -0,0 +1,232 @@
+"""Ahead of time compilation of view helpers, constant subtrees are serialized once
+
+    @template
+    def view_controls(model: BlackjackModel) -> Element:
+        return group({}, [
+            button({"onClick": "Hit", "disabled": None if model.can_hit else "true"}, "Hit"),
+            button({"onClick": "Restart"}, "Restart"),   # built and serialized once
+        ])
+
+On the first call the source of the helper is parsed. Every child of an element whose expression is
+built only from literals, the element builders of fasttea and other templates is evaluated and
+serialized, and the helper is recompiled with these children replaced by their HTML. A render then
+only builds the dynamic parts, adjacent constant children are joined into one string. Like any view
+function a template must only depend on its arguments. Helpers without source or with a closure are
+called as they are.
+"""
+import ast
+import builtins
+import functools
+import inspect
+import textwrap
+import types
+import weakref
+from typing import Any, Callable, List, Set
+
+from . import Element, Markup, StaticMarkup, render_htmx
+
+BUILDER_MODULES = frozenset({'fasttea.html', 'fasttea.picocss', 'fasttea.bootstrap'})
+# builders of fasttea.html whose result depends on more than their arguments
+IMPURE_BUILDERS = frozenset({'lazy', 'virtual_table', 'virtual_list'})
+
+_templates: 'weakref.WeakSet[Callable]' = weakref.WeakSet()
+
+
+def template(fn: Callable[..., Element]) -> Callable[..., Element]:
+    """Decorator which hoists the constant subtrees of a view helper, it is compiled on the first call"""
+    compiled = None
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            nonlocal compiled
+            if compiled is None:
+                compiled = compile_template(fn)
+            return await compiled(*args, **kwargs)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal compiled
+            if compiled is None:
+                compiled = compile_template(fn)
+            return compiled(*args, **kwargs)
+
+    _templates.add(wrapper)
+    return wrapper
+
+
+def compile_template(fn: Callable[..., Element]) -> Callable[..., Element]:
+    """fn with its constant children replaced by their HTML, fn itself if it has none"""
+    code = getattr(fn, '__code__', None)
+    if code is None or code.co_freevars:
+        return fn
+    try:
+        module = ast.parse(textwrap.dedent(inspect.getsource(fn)))
+    except (OSError, TypeError, SyntaxError):
+        return fn
+    function = module.body[0] if module.body else None
+    if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)) or function.name != fn.__name__:
+        return fn
+    # line numbers of tracebacks point into the original file
+    ast.increment_lineno(module, code.co_firstlineno - 1)
+
+    hoister = _Hoister(fn, function)
+    function.body = [hoister.visit(statement) for statement in function.body]
+    if not hoister.values:
+        return fn
+
+    # defaults, annotations and decorators belong to fn and are copied from it
+    function.decorator_list = []
+    function.returns = None
+    arguments = function.args
+    for argument in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+        if argument is not None:
+            argument.annotation = None
+    arguments.defaults = []
+    arguments.kw_defaults = [None] * len(arguments.kwonlyargs)
+
+    # the constants are passed to a factory and become cells of the recompiled function
+    factory = ast.parse(f'def _fasttea_factory({", ".join(hoister.names)}):\n    pass').body[0]
+    factory.body = [function, ast.Return(ast.Name(function.name, ast.Load()))]
+    module.body = [factory]
+    ast.fix_missing_locations(module)
+    try:
+        factory_code = next(const for const in compile(module, code.co_filename, 'exec').co_consts
+                            if isinstance(const, types.CodeType))
+    except (SyntaxError, ValueError, StopIteration):
+        return fn
+    compiled = types.FunctionType(factory_code, fn.__globals__)(*hoister.values)
+    compiled.__defaults__ = fn.__defaults__
+    compiled.__kwdefaults__ = fn.__kwdefaults__
+    return functools.update_wrapper(compiled, fn)
+
+
+def _needs_id(element: Element) -> bool:
+    """Generated ids depend on the position in the whole view, such elements are never serialized alone"""
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        attributes = node.attributes
+        if ('onChange' in attributes or 'onChanging' in attributes) and 'id' not in attributes:
+            return True
+        stack.extend(child for child in node.children if isinstance(child, Element))
+    return False
+
+
+class _Hoister(ast.NodeTransformer):
+    """Replaces constant children of element builder calls by names of their serialized HTML"""
+
+    def __init__(self, fn: Callable, function: ast.AST):
+        self.globals = fn.__globals__
+        self.filename = fn.__code__.co_filename
+        self.locals: Set[str] = set(fn.__code__.co_varnames) | set(fn.__code__.co_cellvars)
+        for node in ast.walk(function):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                self.locals.add(node.id)
+            elif isinstance(node, ast.arg):
+                self.locals.add(node.arg)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.locals.add(node.name)
+        self.names: List[str] = []
+        self.values: List[StaticMarkup] = []
+
+    def _resolve(self, node: ast.AST) -> Any:
+        if isinstance(node, ast.Name):
+            if node.id in self.locals:
+                return None
+            if node.id in self.globals:
+                return self.globals[node.id]
+            return getattr(builtins, node.id, None)
+        if isinstance(node, ast.Attribute):
+            owner = self._resolve(node.value)
+            if inspect.ismodule(owner):
+                return getattr(owner, node.attr, None)
+        return None
+
+    def _children_index(self, builder: Any) -> int:
+        """Position of the children parameter of an element builder, -1 for other functions"""
+        if builder is Element:
+            return 2
+        if (inspect.isfunction(builder) and builder.__module__ in BUILDER_MODULES
+                and builder.__name__ not in IMPURE_BUILDERS):
+            parameters = list(inspect.signature(builder).parameters)
+            return parameters.index('children') if 'children' in parameters else -1
+        return -1
+
+    def _is_pure(self, builder: Any) -> bool:
+        return builder is Element or builder is Markup or builder in _templates or (
+            inspect.isfunction(builder) and builder.__module__ in BUILDER_MODULES
+            and builder.__name__ not in IMPURE_BUILDERS)
+
+    def _is_constant(self, node: ast.AST) -> bool:
+        if isinstance(node, ast.Constant):
+            return True
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return all(not isinstance(elt, ast.Starred) and self._is_constant(elt) for elt in node.elts)
+        if isinstance(node, ast.Dict):
+            return all(key is not None and self._is_constant(key) and self._is_constant(value)
+                       for key, value in zip(node.keys, node.values))
+        if isinstance(node, ast.JoinedStr):
+            return all(self._is_constant(value) for value in node.values)
+        if isinstance(node, ast.FormattedValue):
+            return self._is_constant(node.value) and (node.format_spec is None or self._is_constant(node.format_spec))
+        if isinstance(node, ast.BinOp):
+            return self._is_constant(node.left) and self._is_constant(node.right)
+        if isinstance(node, ast.Call):
+            return (self._is_pure(self._resolve(node.func))
+                    and all(not isinstance(arg, ast.Starred) and self._is_constant(arg) for arg in node.args)
+                    and all(keyword.arg is not None and self._is_constant(keyword.value) for keyword in node.keywords))
+        return False
+
+    def _serialize(self, node: ast.AST) -> Any:
+        """HTML of a constant child, None if it is no element or can't be cached"""
+        if not isinstance(node, ast.Call) or not self._is_constant(node):
+            return None
+        try:
+            value = eval(compile(ast.fix_missing_locations(ast.Expression(node)), self.filename, 'eval'), self.globals)
+        except Exception:
+            return None
+        if not isinstance(value, Element) or _needs_id(value):
+            return None
+        return StaticMarkup(render_htmx(value), render_htmx(value, minify=True))
+
+    def _hoist(self, html: List[StaticMarkup], node: ast.AST) -> ast.AST:
+        name = f'_fasttea_static_{len(self.values)}'
+        self.names.append(name)
+        self.values.append(StaticMarkup(''.join(html), ''.join(part.minified for part in html)))
+        return ast.copy_location(ast.Name(name, ast.Load()), node)
+
+    def _children(self, node: ast.AST) -> ast.AST:
+        if isinstance(node, (ast.List, ast.Tuple)):
+            elts: List[ast.AST] = []
+            run: List[StaticMarkup] = []
+            first = None
+            for elt in node.elts:
+                html = None if isinstance(elt, ast.Starred) else self._serialize(elt)
+                if html is not None:
+                    first = first if run else elt
+                    run.append(html)
+                    continue
+                if run:
+                    elts.append(self._hoist(run, first))
+                    run = []
+                elts.append(self.visit(elt))
+            if run:
+                elts.append(self._hoist(run, first))
+            node.elts = elts
+            return node
+        html = self._serialize(node)
+        if html is not None:
+            return self._hoist([html], node)
+        return self.visit(node)
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        index = self._children_index(self._resolve(node.func))
+        if index < 0:
+            return self.generic_visit(node)
+        node.func = self.visit(node.func)
+        for i, arg in enumerate(node.args):
+            node.args[i] = self._children(arg) if i == index else self.visit(arg)
+        for keyword in node.keywords:
+            keyword.value = self._children(keyword.value) if keyword.arg == 'children' else self.visit(keyword.value)
+        return node
@@ -33,4 +33,5 @@ def view(model: AppModel) -> Element:
         p ({}, model.greeting)
     ])
 
-app.run()
\ No newline at end of file
+if __name__ == "__main__":
+    app.run()
\ No newline at end of file
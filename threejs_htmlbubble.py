@@ -216,4 +216,5 @@ def view(model: CubeModel) -> Element:
         ])
     ]) if model.first_time else view_controlls(model)
 
-app.run()
\ No newline at end of file
+if __name__ == "__main__":
+    app.run()
\ No newline at end of file
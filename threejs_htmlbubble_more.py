@@ -134,4 +134,5 @@ def view(model: CubeModel) -> Element:
 
 
 
-app.run()
\ No newline at end of file
+if __name__ == "__main__":
+    app.run()
\ No newline at end of file